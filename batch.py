@@ -0,0 +1,148 @@
+"""
+Chart every MIDI file in a directory (or matching a glob) without any UI.
+
+    python batch.py songs/ --out charts/
+    python batch.py "songs/*.mid" --settings settings.json --workers 4
+
+Songs are charted in parallel, one process per core by default.
+Settings come from the --settings file, and a song can override any of
+them with a sidecar file next to it: song.mid reads song.settings.json.
+If no song name is set, the name of the MIDI file is used.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+from chart_gen import ChartSettings, write_chart
+from difficulty import write_difficulties
+from do_not_delete_or_move_this.cache import MidiCache
+from do_not_delete_or_move_this.chart_writer import DEFAULT_MS_DIGITS, dump_chart, replace_chart
+from pipeline import write_instrumented
+from streaming import stream_chart
+
+SIDECAR_SUFFIX = '.settings.json'
+
+
+def find_midis(target: str) -> list[str]:
+    """Return the MIDI files in a directory, or the files matching a glob.
+    """
+    if os.path.isdir(target):
+        return sorted(os.path.join(target, f) for f in os.listdir(target)
+                      if f.lower().endswith(('.mid', '.midi')))
+    return sorted(glob.glob(target))
+
+
+def song_settings(midi_path: str, base: dict) -> ChartSettings:
+    """Settings for one song: the base settings overridden by its sidecar.
+    """
+    sjd = dict(base)
+    sidecar = os.path.splitext(midi_path)[0] + SIDECAR_SUFFIX
+    if os.path.exists(sidecar):
+        with open(sidecar) as sj:
+            sjd.update(json.load(sj))
+    if "song" not in sjd:
+        sjd["song"] = os.path.splitext(os.path.basename(midi_path))[0]
+    return ChartSettings.from_json(sjd)
+
+
+def chart_one(midi_path: str, base: dict, out_dir: str, ms_digits: Optional[int] = DEFAULT_MS_DIGITS,
+              compress: bool = False, instrument: bool = False, stream: bool = False,
+              difficulties: bool = False) -> tuple[str, float, Optional[str]]:
+    """Chart a single song. Return the path, how long it took and
+    the error if it failed. Charts are written to a temporary file that
+    replaces the old chart once it is complete, so a failed run leaves the
+    charts of the last good run in place.
+    """
+    start = time.perf_counter()
+    try:
+        settings = song_settings(midi_path, base)
+        json_name = os.path.join(out_dir, settings.song + ('.json.gz' if compress else '.json'))
+        if difficulties:
+            write_difficulties(midi_path, settings, out_dir, MidiCache(), ms_digits, compress)
+        elif instrument:
+            write_instrumented(midi_path, settings, json_name, MidiCache(), ms_digits, compress)
+        elif stream:
+            with replace_chart(json_name, compress) as json_export:
+                dump_chart(stream_chart(midi_path, settings), json_export, ms_digits)
+        else:
+            with replace_chart(json_name, compress) as json_export:
+                write_chart(midi_path, settings, json_export, MidiCache(), ms_digits)
+    except Exception:
+        return midi_path, time.perf_counter() - start, traceback.format_exc()
+    return midi_path, time.perf_counter() - start, None
+
+
+def run(midi_paths: list[str], base: dict, out_dir: str, workers: Optional[int] = None,
+        ms_digits: Optional[int] = DEFAULT_MS_DIGITS, compress: bool = False,
+        instrument: bool = False, stream: bool = False, difficulties: bool = False) -> list[tuple]:
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(chart_one, path, base, out_dir, ms_digits, compress, instrument, stream,
+                                   difficulties)
+                   for path in midi_paths]
+        for future in as_completed(futures):
+            path, seconds, error = future.result()
+            print(f"{'FAILED' if error else 'ok':>6} {seconds:8.3f}s {path}")
+            results.append((path, seconds, error))
+    return results
+
+
+def print_summary(results: list[tuple], wall: float) -> None:
+    failures = [r for r in results if r[2] is not None]
+    total = sum(r[1] for r in results)
+    print()
+    print(f"Charted {len(results) - len(failures)}/{len(results)} songs in {wall:.2f}s "
+          f"({total:.2f}s of chart time)")
+    for path, seconds, _ in sorted(results, key=lambda r: r[1], reverse=True)[:5]:
+        print(f"  slowest: {seconds:8.3f}s {path}")
+    for path, _, error in failures:
+        print(f"\nFailed: {path}\n{error}")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Chart a directory of MIDI files.")
+    parser.add_argument('target', help='a directory of .mid files, or a glob like "songs/*.mid"')
+    parser.add_argument('--settings', default='settings.json',
+                        help='base settings for every song (default: settings.json, if it exists)')
+    parser.add_argument('--out', default='', help='directory to write the charts to')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: one per core)')
+    parser.add_argument('--ms-digits', type=int, default=DEFAULT_MS_DIGITS,
+                        help=f'decimal places kept on note times and sustains (default: {DEFAULT_MS_DIGITS})')
+    parser.add_argument('--gzip', action='store_true', help='write gzipped <song>.json.gz files')
+    parser.add_argument('--instrument', action='store_true',
+                        help='also write <song>.report.json with stage timings and <song>.pstats')
+    parser.add_argument('--stream', action='store_true',
+                        help='write each section as soon as it is charted, using little memory on huge songs')
+    parser.add_argument('--difficulties', action='store_true',
+                        help='write <song>-easy.json, <song>.json (normal) and <song>-hard.json')
+    args = parser.parse_args(argv)
+
+    base = {}
+    if os.path.exists(args.settings):
+        with open(args.settings) as sj:
+            base = json.load(sj)
+        # the song name comes from the sidecar or the file name
+        base.pop("song", None)
+    midi_paths = find_midis(args.target)
+    if not midi_paths:
+        print(f"No MIDI files found at {args.target}")
+        return 1
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    start = time.perf_counter()
+    results = run(midi_paths, base, args.out, args.workers, args.ms_digits, args.gzip, args.instrument,
+                  args.stream, args.difficulties)
+    print_summary(results, time.perf_counter() - start)
+    return 1 if any(r[2] is not None for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
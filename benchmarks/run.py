@@ -0,0 +1,286 @@
+"""
+Per-stage benchmarks of chart generation on synthetic MIDI files.
+
+    python -m benchmarks.run                    # run every scenario
+    python -m benchmarks.run large --repeat 5   # just one
+    python -m benchmarks.run --save-baseline    # store the results as the baseline
+    python -m benchmarks.run --check-parsers    # also check the raw MIDI reader against mido
+    python -m benchmarks.run --check-chords     # also check optimized chords never repeat an arrow
+    python -m benchmarks.run --check-streaming  # also check streamed charts match generate_chart
+
+Every stage is timed separately (best of --repeat runs) and reported with
+its throughput in notes per second. A separate traced run reports the
+peak memory allocated by each stage. If benchmarks/baseline.json exists,
+stages more than --tolerance slower than it are reported as regressions
+and the exit code is 1. The import time of chart_gen is checked against
+IMPORT_BUDGET_MS too.
+
+With --check-parsers, every scenario is also read through mido and
+through the raw reader in smf, with and without a channel and track
+selection, and any difference fails the run. So does a file in
+EDGE_CASES that either parser can't read or that can't be charted. With --check-chords, every
+channel is charted with optimized arrows in every pattern style, and a
+chord of up to 4 notes with two notes on one arrow fails the run. With
+--check-streaming, every scenario is charted by streaming.stream_chart
+and by generate_chart, and any difference in the written chart fails
+the run.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from benchmarks.synth_midi import synth_midi_bytes
+from chart_gen import (ChartSettings, assemble_sections, chart_channel, chart_json, generate_chart,
+                       split_into_sections)
+from do_not_delete_or_move_this import midi2 as mid2, midi3 as mid3
+from do_not_delete_or_move_this.chart_writer import dump_chart
+from do_not_delete_or_move_this.lookahead import repeated_chords
+from do_not_delete_or_move_this.patterns import STYLES
+from streaming import stream_chart
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+IMPORT_BUDGET_MS = 100
+# regressions smaller than this are noise
+MIN_REGRESSION_SECONDS = 0.005
+
+SCENARIOS = {
+    'small': dict(notes=10_000),
+    'large': dict(notes=200_000, chord_density=0.3),
+    'multitrack': dict(notes=50_000, channels=8, tracks=8, tempo_changes=100),
+    'wide': dict(notes=100_000, channels=16, tracks=32, tempo_changes=200),
+}
+# (channels, tracks) selections compared by --check-parsers
+PARSER_CHECKS = ((None, None), ((0, 1), None), ((0, 1, 9), (0, 1)))
+# hand made files --check-parsers also reads and charts: one note after a time signature of 0/4
+EDGE_CASES = {
+    'zero_meter': bytes.fromhex('4d546864000000060001000101e04d54726b0000001500ff58040002180800903c648360803c4000ff2f00'),
+}
+STAGES = ('load_midi', 'midi3.main', 'process_notes', 'split_into_sections', 'compare_sections', 'serialize')
+
+
+def run_stages(midi_bytes: bytes, settings: ChartSettings,
+               measure: Callable[[str, Callable], object], workers: Optional[int] = None) -> int:
+    """Run every stage once through measure(stage name, stage function).
+    Return the number of paired notes.
+    load_midi covers what used to be process_midi and obtain_spb. It
+    decodes tracks in workers processes.
+    """
+    midi_data = measure('load_midi', lambda: mid2.load_midi(midi_bytes, workers=workers))
+    full_mid_data = measure('midi3.main', lambda: mid3.main(midi_data))
+    side_notes = measure('process_notes', lambda: {side: chart_channel(full_mid_data, channel, midi_data, settings)
+                                                   for side, channel in settings.side_channels()})
+    side_sections = measure('split_into_sections', lambda: {side: split_into_sections(notes, midi_data)
+                                                            for side, notes in side_notes.items()})
+    json_notes = measure('compare_sections', lambda: assemble_sections(side_notes, side_sections, midi_data, settings))
+    measure('serialize', lambda: dump_chart(chart_json(json_notes, midi_data, settings), io.StringIO()))
+    return sum(len(notes) for notes in full_mid_data)
+
+
+def bench_scenario(midi_bytes: bytes, repeat: int, workers: Optional[int] = None) -> dict:
+    """Return seconds, peak bytes and notes per second of every stage.
+    """
+    settings = ChartSettings(seed=0)
+    seconds = {}
+
+    def timed(name: str, fn: Callable):
+        start = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - start
+        seconds[name] = min(seconds.get(name, elapsed), elapsed)
+        return value
+
+    for _ in range(repeat):
+        notes = run_stages(midi_bytes, settings, timed, workers)
+
+    peaks = {}
+
+    def traced(name: str, fn: Callable):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        value = fn()
+        peaks[name] = tracemalloc.get_traced_memory()[1] - before
+        return value
+
+    tracemalloc.start()
+    try:
+        run_stages(midi_bytes, settings, traced, workers)
+    finally:
+        tracemalloc.stop()
+    return {name: {"seconds": seconds[name], "peak_bytes": peaks[name],
+                   "notes_per_second": notes / seconds[name] if seconds[name] else float('inf')}
+            for name in STAGES} | {"notes": notes}
+
+
+def check_parsers(midi_bytes: bytes) -> list[str]:
+    """Read the file with the raw reader and with mido. Print both times
+    and return the selections where their output differs.
+    """
+    differences = []
+    for channels, tracks in PARSER_CHECKS:
+        start = time.perf_counter()
+        raw = mid2.load_midi(midi_bytes, channels, tracks)
+        raw_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        mido = mid2.load_midi(midi_bytes, channels, tracks, use_mido=True)
+        mido_seconds = time.perf_counter() - start
+        same = raw == mido
+        print(f"  parsers, channels={channels} tracks={tracks}: raw {raw_seconds:.4f}s, "
+              f"mido {mido_seconds:.4f}s, {'identical' if same else 'DIFFERENT'}")
+        if not same:
+            differences.append(f'channels={channels} tracks={tracks}')
+    return differences
+
+
+def check_edge_cases() -> list[str]:
+    """Read and chart every file in EDGE_CASES with both parsers. Return
+    the ones that fail or where the parsers differ.
+    """
+    failures = []
+    for name, midi_bytes in EDGE_CASES.items():
+        try:
+            same = mid2.load_midi(midi_bytes) == mid2.load_midi(midi_bytes, use_mido=True)
+            generate_chart(midi_bytes, ChartSettings(seed=0))
+        except Exception as e:
+            failures.append(f'{name}: {e!r}')
+            continue
+        if not same:
+            failures.append(f'{name}: raw reader and mido differ')
+    print(f"  edge cases, {', '.join(EDGE_CASES)}: {'ok' if not failures else 'FAILED'}")
+    return failures
+
+
+def check_chords(midi_bytes: bytes) -> list[str]:
+    """Chart every channel with optimized arrows in every style. Return the
+    styles and channels with chords that repeat an arrow.
+    """
+    midi_data = mid2.load_midi(midi_bytes)
+    full_mid_data = mid3.main(midi_data)
+    failures = []
+    for style in STYLES:
+        settings = ChartSettings(seed=0, pattern=style, optimize=True)
+        for channel in range(len(full_mid_data)):
+            notes = chart_channel(full_mid_data, channel, midi_data, settings)
+            repeated = repeated_chords(notes.ms, notes.arrow)
+            if repeated:
+                failures.append(f'{style} channel {channel}: {repeated} chords repeat an arrow')
+    print(f"  chords, {', '.join(STYLES)}: {'ok' if not failures else f'{len(failures)} channels FAILED'}")
+    return failures
+
+
+def check_streaming(midi_bytes: bytes) -> list[str]:
+    """Write the chart with stream_chart and with generate_chart. Print
+    both times and return the differences.
+    """
+    settings = ChartSettings(seed=0, gf_channel=2)
+    start = time.perf_counter()
+    streamed = io.StringIO()
+    dump_chart(stream_chart(midi_bytes, settings), streamed)
+    stream_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    generated = io.StringIO()
+    dump_chart(generate_chart(midi_bytes, settings, lazy=True), generated)
+    generate_seconds = time.perf_counter() - start
+    same = streamed.getvalue() == generated.getvalue()
+    print(f"  streaming: stream_chart {stream_seconds:.4f}s, generate_chart {generate_seconds:.4f}s, "
+          f"{'identical' if same else 'DIFFERENT'}")
+    return [] if same else ['stream_chart and generate_chart differ']
+
+
+def import_time_ms(runs: int = 3) -> float:
+    """Best cumulative import time of chart_gen, from python -X importtime.
+    """
+    best = float('inf')
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import chart_gen'],
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+        last = result.stderr.strip().splitlines()[-1]
+        best = min(best, int(last.split('|')[1]) / 1000)
+    return best
+
+
+def print_report(name: str, result: dict, baseline: Optional[dict], tolerance: float) -> list[str]:
+    """Print one scenario and return its regressions.
+    """
+    regressions = []
+    print(f"\n{name}: {result['notes']} notes")
+    print(f"  {'stage':<20} {'seconds':>9} {'notes/s':>12} {'peak MiB':>9} {'baseline':>9}")
+    for stage in STAGES:
+        stats = result[stage]
+        base = baseline.get(stage, {}).get("seconds") if baseline else None
+        flag = ''
+        if base is not None and stats["seconds"] > base * (1 + tolerance) \
+                and stats["seconds"] - base > MIN_REGRESSION_SECONDS:
+            flag = '  REGRESSION'
+            regressions.append(f'{name}/{stage}: {stats["seconds"]:.4f}s vs {base:.4f}s')
+        print(f"  {stage:<20} {stats['seconds']:>9.4f} {stats['notes_per_second']:>12,.0f} "
+              f"{stats['peak_bytes'] / 2 ** 20:>9.2f} {'' if base is None else f'{base:9.4f}'}{flag}")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark every stage of chart generation.")
+    parser.add_argument('scenarios', nargs='*',
+                        help=f'scenarios to run (default: all of {", ".join(SCENARIOS)})')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario, the best one is kept')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much slower than the baseline a stage may be (default: 0.25)')
+    parser.add_argument('--save-baseline', action='store_true', help=f'write the results to {BASELINE_PATH}')
+    parser.add_argument('--decode-workers', type=int, default=None,
+                        help='processes to decode MIDI tracks in (default: one per core for big files)')
+    parser.add_argument('--check-parsers', action='store_true',
+                        help='check that the raw MIDI reader and mido give the same output')
+    parser.add_argument('--check-streaming', action='store_true',
+                        help='check that streamed charts are the same as the ones generate_chart writes')
+    parser.add_argument('--check-chords', action='store_true',
+                        help='check that optimized arrows never put two notes of a chord on one arrow')
+    args = parser.parse_args(argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario {name}, choose from {", ".join(SCENARIOS)}')
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+
+    results = {}
+    regressions = []
+    for name in args.scenarios or SCENARIOS:
+        midi_bytes = synth_midi_bytes(**SCENARIOS[name])
+        results[name] = bench_scenario(midi_bytes, args.repeat, args.decode_workers)
+        regressions += print_report(name, results[name], baselines.get(name), args.tolerance)
+        if args.check_parsers:
+            regressions += [f'{name}: raw reader and mido differ for {difference}'
+                            for difference in check_parsers(midi_bytes)]
+        if args.check_streaming:
+            regressions += [f'{name}: {failure}' for failure in check_streaming(midi_bytes)]
+        if args.check_chords:
+            regressions += [f'{name}: {failure}' for failure in check_chords(midi_bytes)]
+
+    if args.check_parsers:
+        print("\nedge cases:")
+        regressions += check_edge_cases()
+
+    import_ms = import_time_ms()
+    print(f"\nimport chart_gen: {import_ms:.1f} ms (budget {IMPORT_BUDGET_MS} ms)")
+    if import_ms > IMPORT_BUDGET_MS:
+        regressions.append(f'import chart_gen: {import_ms:.1f} ms is over the {IMPORT_BUDGET_MS} ms budget')
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines | results, f, indent=2)
+        print(f"Saved baseline to {BASELINE_PATH}")
+    if regressions:
+        print("\nRegressions:\n  " + "\n  ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Synthetic MIDI files for benchmarking.
+
+    python -m benchmarks.synth_midi out.mid --notes 100000 --tracks 8 --tempo-changes 50
+"""
+import argparse
+import io
+import random
+from typing import Optional
+
+from mido import Message, MetaMessage, MidiFile, MidiTrack, bpm2tempo
+
+
+def synth_midi(notes: int = 10000, channels: int = 2, chord_density: float = 0.2, tempo_changes: int = 0,
+               tracks: int = 1, ticks_per_beat: int = 480, seed: int = 0) -> MidiFile:
+    """Return a type 1 MIDI file with notes spread over channels and tracks.
+    A conductor track holds the tempo and time signature. Channel c is
+    written to track c % tracks. chord_density is the chance for a note to
+    start together with the one before it. tempo_changes set_tempo events
+    are spread evenly over the song.
+    """
+    rng = random.Random(seed)
+    mid = MidiFile(type=1, ticks_per_beat=ticks_per_beat)
+    per_channel = [notes // channels + (1 if c < notes % channels else 0) for c in range(channels)]
+    track_events = [[] for _ in range(tracks)]
+    song_ticks = 0
+    for channel, count in enumerate(per_channel):
+        events = track_events[channel % tracks]
+        tick = 0
+        for _ in range(count):
+            if rng.random() >= chord_density:
+                tick += rng.choice((ticks_per_beat // 4, ticks_per_beat // 2, ticks_per_beat))
+            pitch = rng.randint(48, 84)
+            length = rng.choice((ticks_per_beat // 8, ticks_per_beat // 4, ticks_per_beat * 2))
+            velocity = rng.choice((40, 100, 100, 100))
+            events.append((tick, 1, Message('note_on', channel=channel, note=pitch, velocity=velocity)))
+            events.append((tick + length, 0, Message('note_off', channel=channel, note=pitch, velocity=0)))
+            song_ticks = max(song_ticks, tick + length)
+
+    conductor = [(0, 0, MetaMessage('set_tempo', tempo=bpm2tempo(120))),
+                 (0, 0, MetaMessage('time_signature', numerator=4, denominator=4))]
+    for i in range(1, tempo_changes + 1):
+        conductor.append((song_ticks * i // (tempo_changes + 1), 0,
+                          MetaMessage('set_tempo', tempo=bpm2tempo(rng.randint(80, 200)))))
+    mid.tracks.append(_to_track(conductor))
+    for events in track_events:
+        mid.tracks.append(_to_track(events))
+    return mid
+
+
+def synth_midi_bytes(**kwargs) -> bytes:
+    f = io.BytesIO()
+    synth_midi(**kwargs).save(file=f)
+    return f.getvalue()
+
+
+def _to_track(events: list[tuple]) -> MidiTrack:
+    """Turn (absolute tick, order, message) into a track with delta times.
+    Note offs sort before note ons at the same tick.
+    """
+    track = MidiTrack()
+    prev_tick = 0
+    for tick, _, message in sorted(events, key=lambda e: (e[0], e[1])):
+        track.append(message.copy(time=tick - prev_tick))
+        prev_tick = tick
+    return track
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Write a synthetic MIDI file.")
+    parser.add_argument('out')
+    parser.add_argument('--notes', type=int, default=10000)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--chord-density', type=float, default=0.2)
+    parser.add_argument('--tempo-changes', type=int, default=0)
+    parser.add_argument('--tracks', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    synth_midi(args.notes, args.channels, args.chord_density, args.tempo_changes, args.tracks,
+               seed=args.seed).save(args.out)
+
+
+if __name__ == '__main__':
+    main()
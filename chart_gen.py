@@ -11,14 +11,25 @@ Autodetect sections:
 """
 import json
 import logging
+import operator
+import os
 import random
+from array import array
+from bisect import bisect_left
 from dataclasses import dataclass
+from itertools import chain, repeat
 # from pprint import pprint
 from pprint import pprint
-from tkinter.filedialog import askopenfile
-from typing import Union
+from typing import Callable, Iterable, Iterator, Optional, TextIO, Union
 
-from do_not_delete_or_move_this import midi3 as mid3, midi2 as mid2
+from do_not_delete_or_move_this import midi2 as mid2
+from do_not_delete_or_move_this.cache import MidiCache, load_paired
+from do_not_delete_or_move_this.chart_stats import ChartDensity, write_stats
+from do_not_delete_or_move_this.chart_writer import DEFAULT_MS_DIGITS, dump_chart
+from do_not_delete_or_move_this.lookahead import optimize_arrows
+from do_not_delete_or_move_this.notes import ChartColumns, NoteColumns
+from do_not_delete_or_move_this.patterns import PatternTable, pattern_table
+from do_not_delete_or_move_this.tempo_map import TempoMap
 
 # logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 
@@ -29,212 +40,427 @@ from do_not_delete_or_move_this import midi3 as mid3, midi2 as mid2
 
 SWAP_BF_EN = False
 
+# the note type the game uses for notes sung by GF
+GF_NOTE_TYPE = "GF Sing"
+
+# called with (ms, pitch, diff, arrow) for every charted note, see set_trace_hook
+_trace_hook: Optional[Callable[[float, int, int, int], None]] = None
+
 
 @dataclass(frozen=True)
 class Preferences:
     jack_mode: int  # the chance out of 3 for jacks to be skipped. 0 <= jack_mode <= 3
     note_tolerance: int  # the % of notes required for camera to focus on character
+    pattern: str = "default"  # the arrow pattern style, see patterns.pattern_table
+    optimize: bool = False  # pick the arrows of all the notes at once, see lookahead.optimize_arrows
 
 
-def process_notes(channel_data, spb: float, prefs: Preferences):
+def process_notes(channel_data: NoteColumns, midi_data: mid2.MidiData, prefs: Preferences,
+                  rng: random.Random) -> ChartColumns:
     """Determine arrow position of notes for a character.
     Channel data must be in time, pitch, velocity, dur format
+
+    Every random number is drawn up front from rng, one per note, and the
+    arrows are picked from them in one pass over the pattern table of
+    prefs.pattern, starting from a random arrow. With prefs.optimize the
+    draws only break ties between equally good arrows.
     """
-    chart_notes = []
-    prev_note = [0, 60, 100, 0.0]
-    prev_pitch = prev_note[1]
-    cur_arrow = random.randint(0, 3)
-    for note in channel_data:
-        logging.debug(f'---------- previous note is {cur_arrow}')
-        cur_pitch = note[1]
-        diff = cur_pitch - prev_pitch
-
-        if cur_pitch < prev_pitch:
-            cur_arrow = (cur_arrow - one_or_two_seed(diff)) % 4
-            logging.debug(f'arrow down due to {cur_pitch} < {prev_pitch}')
-        elif cur_pitch > prev_pitch:
-            cur_arrow = (cur_arrow + one_or_two_seed(diff)) % 4
-            logging.debug(f'arrow up due to {cur_pitch} > {prev_pitch}')
-        elif random.randint(1, 3) <= prefs.jack_mode:
-            logging.debug(f'arrow randomized due to {cur_pitch} == {prev_pitch}')
-            cur_arrow = (cur_arrow + random.randint(-2, 2)) % 4
-        else:
-            logging.debug(f'arrow same due to {cur_pitch} == {prev_pitch}')
-
-        # account for sustains
-        # sus_length = 0 if note[2] >= 60 else note[3]
-        if note[2] < 60 or note[3] > (spb / 2) + 0.0001:
-            sus_length = note[3] * 0.85 * 1000
-        else:
-            sus_length = 0
-        chart_notes.append([note[0] * 1000, cur_arrow, sus_length])
-        prev_pitch = cur_pitch
-        # prev_note = note.copy()
-    return chart_notes
-
-
-def one_or_two(chance: int) -> int:
-    """Return 1 or 2; chance of 2 represented by chance out of 100.
-    """
-    ran = random.randint(0, 100)
-    if chance >= ran:
-        return 2
+    tempo_map = midi_data.tempo_map
+    pitches = channel_data.pitch
+    cur_arrow = rng.randint(0, 3)
+    rand = rng.random
+    rolls = [rand() for _ in range(len(pitches))]
+    table = pattern_table(prefs.pattern, prefs.jack_mode / 3)
+    times = array('d', (time * 1000 for time in channel_data.time))
+    # the first note is compared against a middle C
+    if prefs.optimize:
+        arrows = optimize_arrows(times, pitches, rolls, table, cur_arrow)
+    else:
+        arrows = table.sample(pitches, rolls, cur_arrow)
+    if _trace_hook is not None:
+        for time, pitch, diff, arrow in zip(channel_data.time, pitches,
+                                            map(operator.sub, pitches, chain((60,), pitches)), arrows):
+            _trace_hook(time * 1000, pitch, diff, arrow)
+
+    # account for sustains, longer than an 8th note at the tempo playing
+    # sus_length = 0 if note[2] >= 60 else note[3]
+    if tempo_map.has_changes:
+        spbs = map(tempo_map.spb_at_ms, times)
     else:
-        return 1
+        spbs = repeat(midi_data.spb)
+    sus_lengths = array('d', map(sustain_ms, channel_data.vel, channel_data.dur, spbs))
+    return ChartColumns(times, arrows, sus_lengths)
 
 
-def one_or_two_seed(seed: int) -> int:
-    """Return 1 or 2; chance of 2 represented by seed.
+class NoteCharter:
+    """Picks the arrows of one character's notes one at a time, as they
+    come. Draws from rng in the same order as process_notes, so the
+    arrows are the same too.
     """
-    seed = abs(seed)
-    seed_map = {0: 0, 1: 1, 2: 1, 3: 1, 4: 1, 5: 2, 6: 2, 7: 2, 8: 3}
-    if seed <= 8:
-        chance = seed_map[seed]
-    else:
-        chance = 3
-    rand = random.randint(0, 6)
-    # the greater the chance, the higher that it is a two
-    # meaning
-    if chance >= rand:
-        return 2
-    else:
-        return 1
+
+    def __init__(self, rng: random.Random, table: PatternTable, midi_data: mid2.MidiData):
+        self.arrow = rng.randint(0, 3)
+        self.rand = rng.random
+        self.table = table
+        self.prev_pitch = 60  # the first note is compared against a middle C
+        self.tempo_map = midi_data.tempo_map
+        self.spb = None if self.tempo_map.has_changes else midi_data.spb
+
+    def chart(self, time: float, pitch: int, vel: int, dur: float) -> tuple[float, int, float]:
+        """Return the ms, arrow and sustain of a note in time, pitch,
+        velocity, dur format.
+        """
+        diff = pitch - self.prev_pitch
+        self.prev_pitch = pitch
+        self.arrow = self.table.next_lane(diff, self.arrow, self.rand())
+        ms = time * 1000
+        if _trace_hook is not None:
+            _trace_hook(ms, pitch, diff, self.arrow)
+        spb = self.tempo_map.spb_at_ms(ms) if self.spb is None else self.spb
+        return ms, self.arrow, sustain_ms(vel, dur, spb)
+
+
+def sustain_ms(vel: int, dur: float, spb: float) -> float:
+    """Sustain length of a note lasting dur seconds, 0 if it isn't held.
+    Quiet notes and notes longer than an 8th note at spb are held.
+    """
+    return dur * 0.85 * 1000 if vel < 60 or dur > (spb / 2) + 0.0001 else 0.0
 
 
-def main(path_to: str):
+def set_trace_hook(hook: Optional[Callable[[float, int, int, int], None]]) -> None:
+    """Have process_notes call hook(ms, pitch, diff, arrow) for every note
+    it charts, e.g. instrument.log_trace. None turns tracing off, which
+    costs one check per channel.
+    """
+    global _trace_hook
+    _trace_hook = hook
 
 
+def channel_rng(seed: Optional[int], channel: int) -> random.Random:
+    """Return the random generator for a character's channel.
+    Every channel gets its own stream derived from seed, so channels don't
+    depend on each other's draws. With no seed the stream is unseeded.
+    """
+    if seed is None:
+        return random.Random()
+    return random.Random(f'{seed}:{channel}')
 
-    jack_mode = 1
-    percentage_required = 75
 
-    
+@dataclass(frozen=True)
+class ChartSettings:
+    """Everything process needs besides the MIDI file.
+    """
+    jack_mode: int = 1
+    percentage_required: int = 75
+    p1: str = "bf"
+    p2: str = "dad"
+    gf: str = "gf"
+    song: str = "tempSong"
+    stage: str = ""
+    needs_voices: bool = True
+    scroll_speed: float = 2.4
+    swap_bf_en2: bool = False
+    seed: Optional[int] = None  # same seed, same chart. None for a new chart every time
+    en_channel: int = 0
+    bf_channel: int = 1
+    gf_channel: Optional[int] = None  # charted on EN's side as GF Sing notes
+    tracks: Optional[tuple[int, ...]] = None  # the tracks to read notes from, None for all of them
+    pattern: str = "default"  # an arrow pattern style or a .json table, see patterns.pattern_table
+    optimize: bool = False  # look ahead for the best arrows instead of drawing them one by one
+
+    @classmethod
+    def from_json(cls, sjd: dict) -> 'ChartSettings':
+        """Read the keys of a settings.json file, filling in defaults for
+        anything missing.
+        """
+        return cls(**settings_from_json(sjd))
+
+    def side_channels(self) -> tuple[tuple[str, int], ...]:
+        """The MIDI channel of every character that is charted.
+        """
+        sides = (('en', self.en_channel), ('bf', self.bf_channel))
+        if self.gf_channel is not None:
+            sides += (('gf', self.gf_channel),)
+        return sides
+
+    def channels(self) -> tuple[int, ...]:
+        """The MIDI channels that need to be decoded.
+        """
+        return tuple(sorted({channel for _, channel in self.side_channels()}))
+
+
+def main(path_to: str):
     with open("settings.json") as sj:
         sjd: dict[Union[str, bool, float]] = json.load(sj)
-        
-    p1, p2, gf, song, stage, needs_voices, scroll_speed, swap_bf_en2 = sjd.get("bf", "bf"), sjd.get("en", "dad"), \
-                                                                        sjd.get("gfVersion", "gf"), sjd.get("song",
-                                                                                                            "tempSong"), sjd.get(
-        "stage", ""), sjd.get("hasVoices", True), sjd.get("scrollSpeed", 2.4), sjd.get("swapBfEn", False)
-    # p1, p2, gf, song, stage, needs_voices, scroll_speed = 'bf', 'dad', 'gf', \
-    #                                                      'testsong', 'stage', 'True', '2.4'
-    if "jackMode" in sjd:
-        jack_mode = sjd["jackMode"]
-    if "percentageRequired" in sjd:
-        percentage_required = sjd["percentageRequired"]
-
-
-    process(path_to, jack_mode, percentage_required, p1, p2, gf, song, stage, needs_voices, scroll_speed, swap_bf_en2)
-
-
-
-def process(path_to: str, jack_mode: int, percentage_required: int, p1: str, p2: str, gf: str, song:str , stage:str, needs_voices:bool, scroll_speed:float, swap_bf_en2:bool):
-    pm = mid2.process_midi(path_to)
-    spb = mid2.obtain_spb(path_to)
-    # print(spb)
-    bpm = round(60 / spb, 3)
-    print('Your BPM is ' + str(bpm))
-    full_mid_data = mid3.main(pm)
-    prefs = Preferences(jack_mode, percentage_required)
-    try:
-        full_note_list_en = process_notes(full_mid_data[0], spb, prefs)
-    except IndexError:
-        full_note_list_en = []
-    try:
-        full_note_list_bf = process_notes(full_mid_data[1], spb, prefs)
-    except IndexError:
-        full_note_list_bf = []
-    # pprint(full_note_list)
-    sectioned_en_list = split_into_sections(full_note_list_en, spb)
-    sectioned_bf_list = split_into_sections(full_note_list_bf, spb)
-
-    if swap_bf_en2:
-        sectioned_bf_list, sectioned_en_list = sectioned_en_list, sectioned_bf_list
-
-    # ensure both lists are the same length
-    if len(sectioned_en_list) != len(sectioned_bf_list):
-        len_diff = abs(len(sectioned_bf_list) - len(sectioned_en_list))
-        if len(sectioned_en_list) < len(sectioned_bf_list):
-            for _ in range(0, len_diff):
-                sectioned_en_list.append([])
-        if len(sectioned_en_list) > len(sectioned_bf_list):
-            for _ in range(0, len_diff):
-                sectioned_bf_list.append([])
-
-    musthit = True
-    json_notes = []
-    for en_section, bf_section in zip(sectioned_en_list, sectioned_bf_list):
-        sec_notes, musthit = compare_sections(en_section, bf_section, musthit, prefs)
-        json_notes.append(
-            {"sectionNotes": sec_notes, "lengthInSteps": 16, "mustHitSection": musthit})
-    # pprint(json_notes)
+    process(path_to, **settings_from_json(sjd), instrument=sjd.get("instrument", False),
+            streaming=sjd.get("streaming", False), difficulties=sjd.get("difficulties", False),
+            stats=sjd.get("stats", False))
 
-    full_json = {"song": {"player1": p1, "player2": p2, "gfVersion": gf,
-                          "notes": json_notes, "stage": stage, "needsVoices": needs_voices,
-                          "validScore": True, "bpm": bpm, "speed": scroll_speed, "song": song}}
 
-    json_name = song + '.json'
+def settings_from_json(sjd: dict) -> dict:
+    """Turn the keys of a settings.json file into keyword arguments
+    for process, filling in defaults for anything missing.
+    """
+    return {"jack_mode": sjd.get("jackMode", 1),
+            "percentage_required": sjd.get("percentageRequired", 75),
+            "p1": sjd.get("bf", "bf"),
+            "p2": sjd.get("en", "dad"),
+            "gf": sjd.get("gfVersion", "gf"),
+            "song": sjd.get("song", "tempSong"),
+            "stage": sjd.get("stage", ""),
+            "needs_voices": sjd.get("hasVoices", True),
+            "scroll_speed": sjd.get("scrollSpeed", 2.4),
+            "swap_bf_en2": sjd.get("swapBfEn", False),
+            "seed": sjd.get("seed"),
+            "en_channel": sjd.get("enChannel", 0),
+            "bf_channel": sjd.get("bfChannel", 1),
+            "gf_channel": sjd.get("gfChannel"),
+            "tracks": tuple(sjd["tracks"]) if sjd.get("tracks") is not None else None,
+            "pattern": sjd.get("pattern", "default"),
+            "optimize": sjd.get("optimize", False)}
+
+
+def process(path_to: str, jack_mode: int, percentage_required: int, p1: str, p2: str, gf: str, song:str , stage:str, needs_voices:bool, scroll_speed:float, swap_bf_en2:bool, seed: Optional[int] = None, en_channel: int = 0, bf_channel: int = 1, gf_channel: Optional[int] = None, tracks: Optional[tuple[int, ...]] = None, pattern: str = "default", optimize: bool = False, out_dir: str = '', instrument: bool = False, streaming: bool = False, difficulties: bool = False, stats: bool = False):
+    settings = ChartSettings(jack_mode, percentage_required, p1, p2, gf, song, stage, needs_voices,
+                             scroll_speed, swap_bf_en2, seed, en_channel, bf_channel, gf_channel, tracks, pattern,
+                             optimize)
+    if instrument:
+        # pipeline imports this module, so it can only be imported here
+        from pipeline import write_instrumented
+
+        base_name = os.path.join(out_dir, song)
+        json_name = base_name + '.json'
+        report = write_instrumented(path_to, settings, json_name, MidiCache())
+        print(f"Saved to {json_name}, took {report['total_seconds']:.3f}s. "
+              f"Stage timings are in {base_name}.report.json and the profile in {base_name}.pstats")
+        return
+    if difficulties:
+        from difficulty import write_difficulties
+
+        json_names = write_difficulties(path_to, settings, out_dir, MidiCache(), stats=stats)
+        print(f"Saved to {', '.join(json_names)}")
+        return
+    if streaming and stats:
+        print("Stats need every section at once, so the song isn't streamed")
+        streaming = False
+    if streaming:
+        from streaming import stream_chart
+
+        full_json = stream_chart(path_to, settings)
+    else:
+        # the stats need every section at once
+        full_json = generate_chart(path_to, settings, MidiCache(), lazy=not stats)
+    print('Your BPM is ' + str(full_json["song"]["bpm"]))
+
+    json_name = os.path.join(out_dir, song + '.json')
     # if DISABLE_PROMPTS:
     #     pprint(full_json)
     # else:
     with open(json_name, 'w') as json_export:
-        json.dump(full_json, json_export)
-        print(f"Saved to {json_name} in the working directory")
-
-
-def split_into_sections(notes: list, spb: float):
-    """Split a list of note data into sections. It doesn't matter
-    what format notes is in; the first index must be time in seconds.
-    Time, pitch, vel, dur"""
-    section_length = spb * 4
-    full_note_data = {}
-    for note in notes:
-        note_section = ((note[0] / 1000) + 0.0001) // section_length
-        if note_section not in full_note_data:
-            full_note_data[note_section] = []
-        full_note_data[note_section].append(note)
-    highest_channel = max(int(mm) for mm in full_note_data.keys()) + 1
-    isolated_section_list = [[] for _ in range(0, highest_channel)]
-    for key, item in full_note_data.items():
-        isolated_section_list[int(key)] = item
-    return isolated_section_list
-
-
-def compare_sections(en_section: list,
-                     bf_section: list, prev_musthit: bool, prefs: Preferences) -> \
-        tuple[list, bool]:
-    """Return
-    CombinedSectionList, MustHitSection
-    """
-    if len(en_section) != 0:
-        percent_bf = (len(bf_section) / len(en_section)) * 100
-    elif len(bf_section) == 0:
+        dump_chart(full_json, json_export)
+        print(f"Saved to {json_name}")
+    if stats:
+        stats_name = os.path.join(out_dir, song + '.stats.json')
+        report = write_stats(stats_name, ChartDensity.from_chart(full_json))
+        print(f"Peak NPS is {report['player']['peak_nps']}, stats saved to {stats_name}")
+
+
+def generate_chart(midi: mid2.MidiSource, settings: ChartSettings, cache: Optional[MidiCache] = None,
+                   lazy: bool = False) -> dict:
+    """Return the chart for a MIDI file as a dict ready for json.dump.
+    midi is a path, the bytes of a MIDI file or a binary file object.
+    Nothing is printed or written, other than to cache if one is given.
+    If lazy, the sections under "notes" are a generator for dump_chart
+    to write one at a time instead of a list.
+    """
+    midi_data, full_mid_data = load_paired(midi, cache, settings.channels(), settings.tracks)
+    return chart_from_paired(midi_data, full_mid_data, settings, lazy)
+
+
+def chart_from_paired(midi_data: mid2.MidiData, full_mid_data: list[NoteColumns], settings: ChartSettings,
+                      lazy: bool = False) -> dict:
+    """Return the chart for a MIDI file that was already parsed and paired.
+    """
+    logging.info('BPM is %s', round(60 / midi_data.spb, 3))
+    side_notes = {side: chart_channel(full_mid_data, channel, midi_data, settings)
+                  for side, channel in settings.side_channels()}
+    # pprint(side_notes)
+    side_sections = {side: split_into_sections(notes, midi_data) for side, notes in side_notes.items()}
+    json_notes = assemble_sections(side_notes, side_sections, midi_data, settings, lazy)
+    # pprint(json_notes)
+    return chart_json(json_notes, midi_data, settings)
+
+
+def chart_channel(full_mid_data: list[NoteColumns], channel: int, midi_data: mid2.MidiData,
+                  settings: ChartSettings) -> ChartColumns:
+    """Chart the notes of one MIDI channel, which may not exist.
+    """
+    prefs = Preferences(settings.jack_mode, settings.percentage_required, settings.pattern, settings.optimize)
+    try:
+        return process_notes(full_mid_data[channel], midi_data, prefs, channel_rng(settings.seed, channel))
+    except IndexError:
+        return ChartColumns()
+
+
+def assemble_sections(side_notes: dict[str, ChartColumns], side_sections: dict[str, array],
+                      midi_data: mid2.MidiData, settings: ChartSettings,
+                      lazy: bool = False, must_hits: Optional[list[bool]] = None) -> Union[list[dict], Iterator[dict]]:
+    """Pick the camera for every section and combine every side (keyed
+    "en", "bf" and maybe "gf"), swapping EN and BF first if asked to.
+    must_hits is the camera of every section if it was already picked,
+    see section_cameras.
+    If lazy, yield the sections as they are built.
+    """
+    en, bf = ('bf', 'en') if settings.swap_bf_en2 else ('en', 'bf')
+    prefs = Preferences(settings.jack_mode, settings.percentage_required)
+    sections = iter_sections(side_notes[en], side_sections[en], side_notes[bf], side_sections[bf],
+                             midi_data, prefs, side_notes.get('gf'), side_sections.get('gf'), must_hits)
+    return sections if lazy else list(sections)
+
+
+def chart_json(json_notes: Iterable[dict], midi_data: mid2.MidiData, settings: ChartSettings) -> dict:
+    bpm = round(60 / midi_data.spb, 3)
+    return {"song": {"player1": settings.p1, "player2": settings.p2, "gfVersion": settings.gf,
+                     "notes": json_notes, "stage": settings.stage, "needsVoices": settings.needs_voices,
+                     "validScore": True, "bpm": bpm, "speed": settings.scroll_speed, "song": settings.song}}
+
+
+def write_chart(midi: mid2.MidiSource, settings: ChartSettings, fp: TextIO,
+                cache: Optional[MidiCache] = None, ms_digits: Optional[int] = DEFAULT_MS_DIGITS) -> None:
+    """Generate the chart for a MIDI file and write it as compact JSON to
+    fp, one section at a time.
+    """
+    dump_chart(generate_chart(midi, settings, cache, lazy=True), fp, ms_digits)
+
+
+def split_into_sections(notes: ChartColumns, midi_data: mid2.MidiData) -> array:
+    """Return the section number of every charted note.
+    Section numbers count from zero and a section is one bar, so a
+    4/4 section is 16 steps. Since notes are in time order so are their
+    section numbers."""
+    return array('l', map(midi_data.tempo_map.section_at_ms, notes.ms))
+
+
+def compare_sections(en_notes: ChartColumns, en_sections: array,
+                     bf_notes: ChartColumns, bf_sections: array,
+                     midi_data: mid2.MidiData, prefs: Preferences,
+                     gf_notes: Optional[ChartColumns] = None, gf_sections: Optional[array] = None) -> list[dict]:
+    """Build every section of the song at once.
+    Camera focus comes from the note counts of each section, then every
+    note gets its lane on its side of the chart and the whole song is
+    sorted once and cut at the section boundaries.
+    GF notes don't move the camera. They go on EN's side as GF Sing notes.
+    """
+    return list(iter_sections(en_notes, en_sections, bf_notes, bf_sections, midi_data, prefs,
+                              gf_notes, gf_sections))
+
+
+def iter_sections(en_notes: ChartColumns, en_sections: array,
+                  bf_notes: ChartColumns, bf_sections: array,
+                  midi_data: mid2.MidiData, prefs: Preferences,
+                  gf_notes: Optional[ChartColumns] = None, gf_sections: Optional[array] = None,
+                  must_hits: Optional[list[bool]] = None) -> Iterator[dict]:
+    """Same as compare_sections, but yield each section as it is built.
+    If must_hits is given, it is the camera of every section instead of
+    the one picked from these notes.
+    """
+    if gf_notes is None:
+        gf_notes, gf_sections = ChartColumns(), array('l')
+    if must_hits is None:
+        must_hits = section_cameras(en_sections, bf_sections, prefs.note_tolerance, gf_sections)
+
+    # one column of each side at a time, only the notes of one section are ever copied
+    sides = [(en_notes, en_sections, 4, None), (bf_notes, bf_sections, 0, None),
+             (gf_notes, gf_sections, 4, GF_NOTE_TYPE)]
+    starts = [0] * len(sides)
+    prev_bpm = round(60 / midi_data.spb, 3)
+    for sec, must_hit in enumerate(must_hits):
+        section_notes = []
+        for side, (notes, sections, offset, note_type) in enumerate(sides):
+            lo = starts[side]
+            hi = starts[side] = bisect_left(sections, sec + 1, lo)
+            # if must_hit is true the camera points to bf, whose notes go on the first 4 lanes
+            lane_offset = offset if must_hit else 4 - offset
+            if note_type is None:
+                section_notes.extend([ms, arrow + lane_offset, sus] for ms, arrow, sus
+                                     in zip(notes.ms[lo:hi], notes.arrow[lo:hi], notes.sus[lo:hi]))
+            else:
+                section_notes.extend([ms, arrow + lane_offset, sus, note_type] for ms, arrow, sus
+                                     in zip(notes.ms[lo:hi], notes.arrow[lo:hi], notes.sus[lo:hi]))
+        section_notes.sort(key=operator.itemgetter(0, 1))
+        json_section = section_json(sec, section_notes, must_hit, midi_data.tempo_map, prev_bpm)
+        prev_bpm = json_section.get("bpm", prev_bpm)
+        yield json_section
+
+
+def section_cameras(en_sections: array, bf_sections: array, note_tolerance: int,
+                    gf_sections: Optional[array] = None) -> list[bool]:
+    """Whether the camera points to BF in every section, from the section
+    numbers of EN's and BF's notes. GF's notes only make the song longer.
+    """
+    section_count = max(en_sections[-1] if en_sections else -1,
+                        bf_sections[-1] if bf_sections else -1,
+                        gf_sections[-1] if gf_sections else -1) + 1
+    en_counts = _section_counts(en_sections, section_count)
+    bf_counts = _section_counts(bf_sections, section_count)
+
+    must_hits = []
+    must_hit = True
+    for en_count, bf_count in zip(en_counts, bf_counts):
+        must_hit = next_must_hit(en_count, bf_count, must_hit, note_tolerance)
+        must_hits.append(must_hit)
+    return must_hits
+
+
+def next_must_hit(en_count: int, bf_count: int, must_hit: bool, note_tolerance: int) -> bool:
+    """Whether the camera points to BF for a section with these note
+    counts, given where it pointed for the section before.
+    """
+    if en_count != 0:
+        percent_bf = (bf_count / en_count) * 100
+    elif bf_count == 0:
         percent_bf = 50
     else:
         percent_bf = 100
 
-    if percent_bf >= prefs.note_tolerance:
-        must_hit = True
-    elif prefs.note_tolerance >= percent_bf >= (100 - prefs.note_tolerance):
-        must_hit = not prev_musthit
+    if percent_bf >= note_tolerance:
+        return True
+    elif note_tolerance >= percent_bf >= (100 - note_tolerance):
+        return not must_hit
     else:
-        must_hit = False
-    unsorted_combined_sections = []
-    if must_hit:  # if must_hit is true or if camera points to bf
-        for en_note in en_section:
-            unsorted_combined_sections.append([en_note[0], en_note[1] + 4, en_note[2]])
-        for bf_note in bf_section:
-            unsorted_combined_sections.append([bf_note[0], bf_note[1], bf_note[2]])
-    else:  # if must_hit is false or if cam points to en
-        for en_note in en_section:
-            unsorted_combined_sections.append([en_note[0], en_note[1], en_note[2]])
-        for bf_note in bf_section:
-            unsorted_combined_sections.append([bf_note[0], bf_note[1] + 4, bf_note[2]])
-    sorted_combined_sections = sorted(unsorted_combined_sections, key=lambda x: (x[0], x[1]))
-    return sorted_combined_sections, must_hit
+        return False
+
+
+def section_json(sec: int, section_notes: list[list], must_hit: bool, tempo_map: TempoMap,
+                 prev_bpm: float) -> dict:
+    """The JSON of one section. Songs with tempo or time signature changes
+    also get the BPM of the section and whether it differs from prev_bpm.
+    """
+    json_section = {"sectionNotes": section_notes, "lengthInSteps": tempo_map.section_steps(sec),
+                    "mustHitSection": must_hit}
+    if tempo_map.has_changes:
+        bpm = tempo_map.section_bpm(sec)
+        json_section["bpm"] = bpm
+        json_section["changeBPM"] = bpm != prev_bpm
+    return json_section
+
+
+def _section_counts(sections: array, section_count: int) -> list[int]:
+    """Count the notes in each section.
+    """
+    counts = [0] * section_count
+    for sec in sections:
+        counts[sec] += 1
+    return counts
 
 
 if __name__ == '__main__':
+    import multiprocessing
+    from tkinter.filedialog import askopenfile
+
+    # worker processes of a frozen build must not open the file dialog again
+    multiprocessing.freeze_support()
+
     path = askopenfile(mode="r", title="Open the MIDI file you would like to read.",
                        filetypes=[("Midi File", "*.mid")])
     print('File selected')
@@ -0,0 +1,155 @@
+"""
+Easy, normal and hard charts from a single run.
+
+The hard chart is the full chart. Easier ones are made by thinning it:
+
+    - notes off the grid of the difficulty (8ths, quarter notes) are dropped,
+    - at most so many notes are kept in every window of steps,
+    - sustains are shortened.
+
+Every difficulty keeps the arrows of the notes it keeps, and the camera
+of every section is picked once from the full chart, so the difficulties
+only differ by the notes that were taken out.
+
+    charts = generate_difficulties("bopeebo.mid", settings)
+    write_difficulties("bopeebo.mid", settings, out_dir="charts")  # bopeebo-easy.json, bopeebo.json, bopeebo-hard.json
+
+Thinning works on note positions in steps, so it expects a quantized
+MIDI file: a note played a bit off the grid counts as off the grid.
+"""
+import os
+from array import array
+from dataclasses import dataclass
+from itertools import compress
+from math import floor
+from typing import Optional
+
+from chart_gen import (ChartSettings, assemble_sections, chart_channel, chart_json, section_cameras,
+                       split_into_sections)
+from do_not_delete_or_move_this import midi2 as mid2
+from do_not_delete_or_move_this.cache import MidiCache, load_paired
+from do_not_delete_or_move_this.chart_stats import ChartDensity, write_stats
+from do_not_delete_or_move_this.chart_writer import DEFAULT_MS_DIGITS, dump_chart, replace_chart
+from do_not_delete_or_move_this.notes import ChartColumns, NoteColumns
+from do_not_delete_or_move_this.tempo_map import TempoMap
+
+# how far from a grid line (in steps) a note still counts as on it
+GRID_TOLERANCE = 0.1
+
+
+@dataclass(frozen=True)
+class Difficulty:
+    """How to thin the full chart into one difficulty.
+    """
+    name: str
+    suffix: str  # added to the song name for the file name, "-easy" for <song>-easy.json
+    grid_steps: Optional[int] = None  # only notes on multiples of this many steps are kept
+    max_notes: Optional[int] = None  # at most this many notes in every window
+    window_steps: int = 4
+    sustain_scale: float = 1.0
+
+
+EASY = Difficulty("easy", "-easy", grid_steps=4, max_notes=1, sustain_scale=0.5)
+NORMAL = Difficulty("normal", "", grid_steps=2, max_notes=3, sustain_scale=0.75)
+HARD = Difficulty("hard", "-hard")
+DIFFICULTIES = (EASY, NORMAL, HARD)
+
+
+def note_steps(notes: ChartColumns, tempo_map: TempoMap) -> array:
+    """The position of every note in steps (16th notes) from the start of
+    the song.
+    """
+    steps_per_tick = 4 / tempo_map.ticks_per_beat
+    return array('d', (tick * steps_per_tick for tick in tempo_map.ms_to_ticks(notes.ms)))
+
+
+def thin(notes: ChartColumns, sections: array, steps: array,
+         difficulty: Difficulty) -> tuple[ChartColumns, array]:
+    """Return the notes of one side kept in a difficulty and their section
+    numbers. steps is note_steps of the notes.
+    """
+    if difficulty.grid_steps is not None:
+        grid = difficulty.grid_steps
+        keep = [abs(step - round(step / grid) * grid) <= GRID_TOLERANCE for step in steps]
+    elif difficulty.max_notes is None and difficulty.sustain_scale == 1:
+        return notes, sections
+    else:
+        keep = [True] * len(notes)
+    if difficulty.max_notes is not None:
+        # notes are in time order, so every window is one run
+        window_steps = difficulty.window_steps
+        window = None
+        count = 0
+        for i, step in enumerate(steps):
+            if not keep[i]:
+                continue
+            note_window = floor((step + GRID_TOLERANCE) / window_steps)
+            if note_window != window:
+                window = note_window
+                count = 0
+            count += 1
+            keep[i] = count <= difficulty.max_notes
+    sus = compress(notes.sus, keep)
+    if difficulty.sustain_scale != 1:
+        sus = (length * difficulty.sustain_scale for length in sus)
+    thinned = ChartColumns(array('d', compress(notes.ms, keep)), array('b', compress(notes.arrow, keep)),
+                           array('d', sus))
+    return thinned, array('l', compress(sections, keep))
+
+
+def chart_difficulties(midi_data: mid2.MidiData, full_mid_data: list[NoteColumns], settings: ChartSettings,
+                       difficulties: tuple[Difficulty, ...] = DIFFICULTIES, lazy: bool = False) -> dict[str, dict]:
+    """Return the chart of every difficulty, keyed by its name, for a MIDI
+    file that was already parsed and paired.
+    """
+    side_notes = {side: chart_channel(full_mid_data, channel, midi_data, settings)
+                  for side, channel in settings.side_channels()}
+    side_sections = {side: split_into_sections(notes, midi_data) for side, notes in side_notes.items()}
+    side_steps = {side: note_steps(notes, midi_data.tempo_map) for side, notes in side_notes.items()}
+    en, bf = ('bf', 'en') if settings.swap_bf_en2 else ('en', 'bf')
+    # every difficulty gets the camera of the full chart
+    must_hits = section_cameras(side_sections[en], side_sections[bf], settings.percentage_required,
+                                side_sections.get('gf'))
+    charts = {}
+    for difficulty in difficulties:
+        thinned = {side: thin(notes, side_sections[side], side_steps[side], difficulty)
+                   for side, notes in side_notes.items()}
+        json_notes = assemble_sections({side: notes for side, (notes, _) in thinned.items()},
+                                       {side: sections for side, (_, sections) in thinned.items()},
+                                       midi_data, settings, lazy, must_hits)
+        charts[difficulty.name] = chart_json(json_notes, midi_data, settings)
+    return charts
+
+
+def generate_difficulties(midi: mid2.MidiSource, settings: ChartSettings, cache: Optional[MidiCache] = None,
+                          difficulties: tuple[Difficulty, ...] = DIFFICULTIES, lazy: bool = False) -> dict[str, dict]:
+    """Like chart_gen.generate_chart, but return the chart of every
+    difficulty keyed by its name.
+    """
+    midi_data, full_mid_data = load_paired(midi, cache, settings.channels(), settings.tracks)
+    return chart_difficulties(midi_data, full_mid_data, settings, difficulties, lazy)
+
+
+def chart_path(out_dir: str, song: str, difficulty: Difficulty, compress: bool = False) -> str:
+    return os.path.join(out_dir, song + difficulty.suffix + ('.json.gz' if compress else '.json'))
+
+
+def write_difficulties(midi: mid2.MidiSource, settings: ChartSettings, out_dir: str = '',
+                       cache: Optional[MidiCache] = None, ms_digits: Optional[int] = DEFAULT_MS_DIGITS,
+                       compress: bool = False, difficulties: tuple[Difficulty, ...] = DIFFICULTIES,
+                       stats: bool = False) -> list[str]:
+    """Write the chart of every difficulty to out_dir. Return the file names.
+    If stats, the report of every difficulty goes next to its chart as
+    <song><suffix>.stats.json.
+    """
+    charts = generate_difficulties(midi, settings, cache, difficulties, lazy=not stats)
+    json_names = []
+    for difficulty in difficulties:
+        json_name = chart_path(out_dir, settings.song, difficulty, compress)
+        with replace_chart(json_name, compress) as json_export:
+            dump_chart(charts[difficulty.name], json_export, ms_digits)
+        json_names.append(json_name)
+        if stats:
+            write_stats(os.path.join(out_dir, settings.song + difficulty.suffix + '.stats.json'),
+                        ChartDensity.from_chart(charts[difficulty.name]))
+    return json_names
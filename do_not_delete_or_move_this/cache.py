@@ -0,0 +1,155 @@
+"""On-disk cache of parsed and paired MIDI data.
+
+Entries are keyed by a hash of the MIDI bytes and PARSER_VERSION, so
+rerunning with different settings skips parsing and pairing entirely.
+Each entry is one file: a JSON header followed by the raw bytes of
+every array, read back through mmap. The least recently used entries
+are evicted once the cache grows past max_bytes.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Collection, Optional
+
+from do_not_delete_or_move_this import midi2 as mid2, midi3 as mid3
+from do_not_delete_or_move_this.notes import EventColumns, NoteColumns
+from do_not_delete_or_move_this.tempo_map import TempoMap
+
+# bump this whenever parsing or pairing changes what they produce
+PARSER_VERSION = 1
+MAGIC = b'FCGC'
+EXTENSION = '.fcgc'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def default_cache_dir() -> str:
+    return os.environ.get('FCG_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'funkin-chart-generator'))
+
+
+class MidiCache:
+    """A size-bounded directory of parsed MIDI files.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(midi_bytes: bytes, channels: Optional[Collection[int]] = None,
+            tracks: Optional[Collection[int]] = None) -> str:
+        selection = [sorted(channels) if channels is not None else None,
+                     sorted(tracks) if tracks is not None else None]
+        digest = hashlib.sha256(f'{PARSER_VERSION}:{sys.byteorder}:{selection}:'.encode())
+        digest.update(midi_bytes)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def load(self, midi: mid2.MidiSource, channels: Optional[Collection[int]] = None,
+             tracks: Optional[Collection[int]] = None) -> tuple[mid2.MidiData, list[NoteColumns]]:
+        """Return the tempo data and the paired notes of every channel,
+        limited to the given channels and tracks like load_midi.
+        The returned MidiData has no raw events; they are only needed for
+        pairing.
+        """
+        midi_bytes = mid2.read_midi_bytes(midi)
+        path = self._path(self.key(midi_bytes, channels, tracks))
+        try:
+            entry = _read_entry(path)
+        except (OSError, ValueError):
+            entry = None
+        if entry is not None:
+            # mark it as recently used
+            try:
+                os.utime(path)
+            except OSError:
+                pass  # another process evicted it after it was read
+            return entry
+        midi_data = mid2.load_midi(midi_bytes, channels, tracks)
+        full_mid_data = mid3.main(midi_data)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            _write_entry(path, midi_data, full_mid_data)
+            self.evict()
+        except OSError:
+            pass  # a cache that can't be written is just a slower run
+        return midi_data, full_mid_data
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache fits.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(EXTENSION):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue  # another process evicted it first
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+
+
+def load_paired(midi: mid2.MidiSource, cache: Optional[MidiCache] = None,
+                channels: Optional[Collection[int]] = None, tracks: Optional[Collection[int]] = None) \
+        -> tuple[mid2.MidiData, list[NoteColumns]]:
+    """Parse and pair a MIDI file, going through cache if there is one.
+    """
+    if cache is None:
+        midi_data = mid2.load_midi(midi, channels, tracks)
+        return midi_data, mid3.main(midi_data)
+    return cache.load(midi, channels, tracks)
+
+
+def _write_entry(path: str, midi_data: mid2.MidiData, channels: list[NoteColumns]) -> None:
+    arrays = [(name, getattr(midi_data.tempo_map, name)) for name in TempoMap.ARRAYS]
+    for channel, notes in enumerate(channels):
+        for (field, _), column in zip(NoteColumns.FIELDS, notes.columns()):
+            arrays.append((f'{channel}.{field}', column))
+    header = json.dumps({'tempo': midi_data.tempo, 'ticks_per_beat': midi_data.ticks_per_beat,
+                         'channels': len(channels),
+                         'arrays': [[name, a.typecode, len(a) * a.itemsize] for name, a in arrays]}).encode()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(header)) + header)
+            for _, a in arrays:
+                a.tofile(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _read_entry(path: str) -> tuple[mid2.MidiData, list[NoteColumns]]:
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:4] != MAGIC:
+            raise ValueError(f'{path} is not a cache entry')
+        header_length, = struct.unpack('<I', mm[4:8])
+        header = json.loads(mm[8:8 + header_length])
+        arrays = {}
+        offset = 8 + header_length
+        for name, typecode, length in header['arrays']:
+            column = array(typecode)
+            column.frombytes(mm[offset:offset + length])
+            arrays[name] = column
+            offset += length
+    tempo_map = TempoMap.from_arrays(header['ticks_per_beat'], arrays)
+    midi_data = mid2.MidiData(header['tempo'], header['ticks_per_beat'], EventColumns(), tempo_map)
+    channels = [NoteColumns(*(arrays[f'{channel}.{field}'] for field, _ in NoteColumns.FIELDS))
+                for channel in range(header['channels'])]
+    return midi_data, channels
@@ -0,0 +1,169 @@
+"""How dense and how hard a finished chart is.
+
+A DensityIndex holds the notes of one strumline in time order with
+running counts of jacks and of every arrow next to them, so the note
+count, notes per second, jacks and lane balance of any window of time
+take two binary searches. ChartDensity builds one for the player's and
+one for the opponent's strumline from the sections of a chart, once,
+along with the note count of every section, and chart_stats turns it
+into the report written next to the chart as <song>.stats.json.
+"""
+import json
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+# the window peak and histogram notes per second are counted over
+NPS_WINDOW_MS = 1000.0
+
+
+class DensityIndex:
+    """Prefix counts over the notes of one strumline. ms and arrows (0-3)
+    must be in time order.
+    """
+
+    def __init__(self, ms: array, arrows: array):
+        self.ms = ms
+        self.arrows = arrows
+        # jacks[i] is the number of jacks among the first i notes
+        self.jacks = array('l', accumulate(map(int.__eq__, arrows, arrows[1:]), initial=0))
+        self.jacks.insert(0, 0)
+        self.lanes = [array('l', accumulate((arrow == lane for arrow in arrows), initial=0)) for lane in range(4)]
+
+    def __len__(self) -> int:
+        return len(self.ms)
+
+    def span(self, start_ms: float, end_ms: float) -> tuple[int, int]:
+        """The indexes of the first note at or after start_ms and of the
+        first note at or after end_ms.
+        """
+        lo = bisect_left(self.ms, start_ms)
+        return lo, bisect_left(self.ms, end_ms, lo)
+
+    def count(self, start_ms: float, end_ms: float) -> int:
+        lo, hi = self.span(start_ms, end_ms)
+        return hi - lo
+
+    def nps(self, start_ms: float, end_ms: float) -> float:
+        if end_ms <= start_ms:
+            return 0.0
+        return self.count(start_ms, end_ms) * 1000 / (end_ms - start_ms)
+
+    def jack_count(self, start_ms: float, end_ms: float) -> int:
+        """Notes in the window on the same arrow as the note before them,
+        which is in the window too.
+        """
+        lo, hi = self.span(start_ms, end_ms)
+        return self.jacks[hi] - self.jacks[min(lo + 1, hi)]
+
+    def lane_counts(self, start_ms: float, end_ms: float) -> list[int]:
+        lo, hi = self.span(start_ms, end_ms)
+        return [lane[hi] - lane[lo] for lane in self.lanes]
+
+    def peak_nps(self, window_ms: float = NPS_WINDOW_MS) -> float:
+        """The most notes in any window_ms long window, per second.
+        """
+        peak = 0
+        ms = self.ms
+        hi = 0
+        for lo, start in enumerate(ms):
+            while hi < len(ms) and ms[hi] < start + window_ms:
+                hi += 1
+            peak = max(peak, hi - lo)
+        return peak * 1000 / window_ms
+
+    def nps_histogram(self, end_ms: float, window_ms: float = NPS_WINDOW_MS) -> list[int]:
+        """How many of the consecutive window_ms windows up to end_ms hold
+        0, 1, 2... notes.
+        """
+        histogram = [0]
+        for window in range(int(end_ms // window_ms) + 1):
+            count = self.count(window * window_ms, (window + 1) * window_ms)
+            if count >= len(histogram):
+                histogram.extend([0] * (count + 1 - len(histogram)))
+            histogram[count] += 1
+        return histogram
+
+
+class ChartDensity:
+    """The density indexes of both strumlines of a chart, built from its
+    sections. Lanes 0-3 are the player's in sections where mustHitSection
+    is set and the opponent's otherwise. GF's notes are on the opponent's.
+    bpm is the BPM of the song, for sections that don't set their own.
+    """
+
+    def __init__(self, sections: list[dict], bpm: float):
+        self.must_hits = []
+        self.section_ms = []  # the length of every section
+        self.section_counts = {True: [], False: []}  # keyed by whether the player hits the notes
+        notes = {True: [], False: []}
+        for section in sections:
+            must_hit = section["mustHitSection"]
+            self.must_hits.append(must_hit)
+            self.section_ms.append(section["lengthInSteps"] * 15000 / section.get("bpm", bpm))
+            for counts in self.section_counts.values():
+                counts.append(0)
+            for note in section["sectionNotes"]:
+                player = (note[1] < 4) == must_hit
+                notes[player].append((note[0], note[1] % 4))
+                self.section_counts[player][-1] += 1
+        self.player = _index(notes[True])
+        self.opponent = _index(notes[False])
+
+    @classmethod
+    def from_chart(cls, chart: dict) -> 'ChartDensity':
+        """Index a chart as made by chart_gen.generate_chart, with its
+        sections in a list.
+        """
+        return cls(chart["song"]["notes"], chart["song"]["bpm"])
+
+    @property
+    def camera_switches(self) -> int:
+        return sum(1 for prev, cur in zip(self.must_hits, self.must_hits[1:]) if prev != cur)
+
+    @property
+    def end_ms(self) -> float:
+        return max(self.player.ms[-1] if self.player.ms else 0.0,
+                   self.opponent.ms[-1] if self.opponent.ms else 0.0)
+
+    def section_nps(self, player: bool) -> list[float]:
+        """Notes per second of a strumline in every section.
+        """
+        return [round(count * 1000 / ms, 3) for count, ms in zip(self.section_counts[player], self.section_ms)]
+
+
+def _index(notes: list[tuple[float, int]]) -> DensityIndex:
+    notes.sort()
+    return DensityIndex(array('d', (ms for ms, _ in notes)), array('b', (arrow for _, arrow in notes)))
+
+
+def strumline_stats(index: DensityIndex, end_ms: float) -> dict:
+    lanes = index.lane_counts(float('-inf'), float('inf'))
+    return {"notes": len(index),
+            "peak_nps": index.peak_nps(),
+            "mean_nps": round(len(index) * 1000 / end_ms, 3) if end_ms > 0 else 0.0,
+            "jacks": index.jacks[-1],
+            "lanes": lanes,
+            # 1 when every arrow is used as often, 0 when an arrow is never used
+            "lane_balance": round(min(lanes) / max(lanes), 3) if max(lanes) else 1.0,
+            "nps_histogram": index.nps_histogram(end_ms)}
+
+
+def chart_stats(density: ChartDensity) -> dict:
+    """The difficulty report of a chart.
+    """
+    end_ms = density.end_ms
+    return {"seconds": round(end_ms / 1000, 3),
+            "camera_switches": density.camera_switches,
+            "player": strumline_stats(density.player, end_ms),
+            "opponent": strumline_stats(density.opponent, end_ms),
+            "section_nps": {"player": density.section_nps(True), "opponent": density.section_nps(False)}}
+
+
+def write_stats(path: str, density: ChartDensity) -> dict:
+    """Write the report of a chart to path as JSON. Return the report.
+    """
+    report = chart_stats(density)
+    with open(path, 'w') as f:
+        json.dump(report, f)
+    return report
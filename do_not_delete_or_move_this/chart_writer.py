@@ -0,0 +1,78 @@
+"""Streaming writer for chart JSON.
+
+Sections are written one at a time as they are produced, so the whole
+list of sections never has to exist at once. Output uses compact
+separators, and note times and sustains are rounded to ms_digits
+decimal places (None keeps full precision). The result is plain JSON
+that the game loads like any other chart.
+"""
+import gzip
+import json
+import os
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, TextIO
+
+DEFAULT_MS_DIGITS = 3
+SEPARATORS = (',', ':')
+
+
+def dump_chart(chart: dict, fp: TextIO, ms_digits: Optional[int] = DEFAULT_MS_DIGITS) -> None:
+    """Write a chart to fp. chart["song"]["notes"] may be any iterable
+    of sections, such as a generator.
+    """
+    fp.write('{"song":{')
+    for i, (key, value) in enumerate(chart["song"].items()):
+        if i:
+            fp.write(',')
+        fp.write(json.dumps(key))
+        fp.write(':')
+        if key == "notes":
+            dump_sections(value, fp, ms_digits)
+        else:
+            fp.write(json.dumps(value, separators=SEPARATORS))
+    fp.write('}}')
+
+
+def dump_sections(sections: Iterable[dict], fp: TextIO, ms_digits: Optional[int] = DEFAULT_MS_DIGITS) -> None:
+    fp.write('[')
+    for i, section in enumerate(sections):
+        if i:
+            fp.write(',')
+        if ms_digits is not None:
+            section = dict(section, sectionNotes=round_notes(section["sectionNotes"], ms_digits))
+        fp.write(json.dumps(section, separators=SEPARATORS))
+    fp.write(']')
+
+
+def round_notes(notes: list[list], ms_digits: int) -> list[list]:
+    """Round the time and sustain of every [ms, lane, sus, ...] note.
+    """
+    if ms_digits == 0:
+        return [[round(note[0]), note[1], round(note[2])] + note[3:] for note in notes]
+    return [[round(note[0], ms_digits), note[1], round(note[2], ms_digits)] + note[3:] for note in notes]
+
+
+def open_chart(path: str, compress: bool = False) -> TextIO:
+    """Open path for writing a chart, gzipped if compress is set.
+    """
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w')
+
+
+@contextmanager
+def replace_chart(path: str, compress: bool = False) -> Iterator[TextIO]:
+    """Like open_chart, but the chart is written to a temporary file next
+    to path that replaces it once it is complete. Anything reading path
+    sees either the old chart or the new one, never half of one.
+    """
+    # made by hand rather than with tempfile so it gets the usual permissions
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open_chart(tmp_path, compress) as fp:
+            yield fp
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
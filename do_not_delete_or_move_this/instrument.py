@@ -0,0 +1,86 @@
+"""Opt-in instrumentation of chart generation runs.
+
+An Instrumentation records the wall time, note count and allocation
+peak (through tracemalloc) of every stage it is told about, and can
+profile the whole run with cProfile. Nothing here runs unless asked to.
+
+log_trace is a trace hook for chart_gen.set_trace_hook that logs the
+arrow chosen for every note at DEBUG level.
+"""
+import cProfile
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class Instrumentation:
+    """Use as a context manager around a run, and wrap each stage in
+    stage(name). Stage records are kept in order in stages.
+    """
+
+    def __init__(self, profile: bool = False, trace_memory: bool = True):
+        self.profiler = cProfile.Profile() if profile else None
+        self.trace_memory = trace_memory
+        self.stages: list[dict] = []
+        self._started_tracemalloc = False
+        self._start = 0.0
+        self.total_seconds = 0.0
+
+    def __enter__(self) -> 'Instrumentation':
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.profiler is not None:
+            self.profiler.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.total_seconds = time.perf_counter() - self._start
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict]:
+        """Time a stage. The yielded record can be given a "notes" count
+        or marked "cached".
+        """
+        record = {"stage": name}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if tracing:
+                record["peak_bytes"] = tracemalloc.get_traced_memory()[1] - before
+            self.stages.append(record)
+
+    def report(self) -> dict:
+        return {"total_seconds": self.total_seconds, "stages": self.stages}
+
+    def write_report(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_profile(self, path: str) -> Optional[str]:
+        """Write the cProfile stats, readable with pstats. Return the path,
+        or None if the run wasn't profiled.
+        """
+        if self.profiler is None:
+            return None
+        self.profiler.dump_stats(path)
+        return path
+
+
+def log_trace(ms: float, pitch: int, diff: int, arrow: int) -> None:
+    logging.debug('%.3f ms: pitch %d (%+d), arrow %d', ms, pitch, diff, arrow)
@@ -0,0 +1,183 @@
+"""Arrows picked for a whole strumline at once.
+
+Instead of drawing every arrow from the one before it, optimize_arrows
+finds the arrows of all the notes with the lowest total cost, with a
+Viterbi pass over the 4 lanes: for every note and every lane it keeps the
+cheapest way to get there, so the work is 16 sums per note. Inside a
+chord the lanes the chord already used are part of the state too, so no
+two notes of a chord share a lane, for at most 128 sums per note.
+
+Moving from one arrow to the next costs:
+
+    contour     -log of the chance the pattern table gives the move, so
+                the likely moves of the pattern keep following the pitch,
+                and MISS_COST for moves the table never makes
+    jacks       the same arrow twice in a row within FAST_MS
+    chords      the same arrow twice in a chord of more than 4 notes,
+                the only chords that can't be spread over the lanes
+    crossovers  a jump from the left arrow to the right one or back
+                within FAST_MS
+
+Since it looks at what comes next, it keeps arrows away from the edge
+before a run up or down instead of wrapping around.
+"""
+from array import array
+from functools import lru_cache
+from math import inf, log
+from operator import sub
+from typing import Iterable, Sequence
+
+from do_not_delete_or_move_this.patterns import LANES, MAX_DELTA, PatternTable, delta_rows
+
+# notes closer than this (in ms) are a chord
+CHORD_MS = 1.0
+# notes closer than this (in ms) are fast enough for jacks and crossovers to hurt
+FAST_MS = 250.0
+
+MISS_COST = 3.0
+JACK_COST = 4.0
+CHORD_COST = 100.0
+CROSSOVER_COST = 2.0
+# breaks ties between equally good arrows with the draws, so seeds still matter
+TIE_COST = 1e-9
+
+# of equally good arrows, the one a draw falls on wins, then the ones right of it
+_TIES = [tuple(TIE_COST * ((lane - favoured) % LANES) for lane in range(LANES)) for favoured in range(LANES)]
+
+# the state of a note on every lane outside of a chord, see optimize_arrows
+_SINGLES = tuple(1 << lane << 2 | lane for lane in range(LANES))
+
+
+def _chord_moves(state: int) -> tuple[tuple[int, int, int], ...]:
+    mask = state >> 2
+    a = state & 3
+    if mask == (1 << LANES) - 1:
+        # a chord of more than 4 notes starts over
+        return tuple((b * LANES + a, b, _SINGLES[b]) for b in range(LANES))
+    return tuple((b * LANES + a, b, (mask | 1 << b) << 2 | b) for b in range(LANES) if not mask >> b & 1)
+
+
+# the index of the move cost, the lane and the state of every next note
+# in a chord after a state, by state
+_CHORD_MOVES = [_chord_moves(state) if state >> 2 >> (state & 3) & 1 else ()
+                for state in range(1 << LANES << 2)]
+
+# how far apart two notes are, added to the row of the pitch delta
+_CHORD, _FAST, _SLOW = 0, 1, 2
+
+
+@lru_cache(maxsize=32)
+def transition_costs(table: PatternTable) -> list[tuple[float, ...]]:
+    """The cost of every move, indexed like the rows of the table plus how
+    far apart the notes are. Every entry lists the cost from lane a to
+    lane b at b * LANES + a.
+    """
+    costs = []
+    for delta in range(-MAX_DELTA, MAX_DELTA + 1):
+        chances = [table.chances(delta, lane) for lane in range(LANES)]
+        for gap in (_CHORD, _FAST, _SLOW, _SLOW):
+            move_costs = []
+            for b in range(LANES):
+                for a in range(LANES):
+                    chance = chances[a][b]
+                    cost = -log(chance) if chance > 0 else MISS_COST
+                    if a == b and gap != _SLOW:
+                        cost += CHORD_COST if gap == _CHORD else JACK_COST
+                    elif abs(a - b) == LANES - 1 and gap == _FAST:
+                        cost += CROSSOVER_COST
+                    move_costs.append(cost)
+            costs.append(tuple(move_costs))
+    return costs
+
+
+def _cheapest(c0: float, c1: float, c2: float, c3: float) -> tuple[float, int]:
+    if c0 <= c1:
+        if c0 <= c2:
+            return (c0, 0) if c0 <= c3 else (c3, 3)
+        return (c2, 2) if c2 <= c3 else (c3, 3)
+    if c1 <= c2:
+        return (c1, 1) if c1 <= c3 else (c3, 3)
+    return (c2, 2) if c2 <= c3 else (c3, 3)
+
+
+def optimize_arrows(ms: Sequence[float], pitches: Sequence[int], rolls: Iterable[float], table: PatternTable,
+                    lane: int, prev_pitch: int = 60) -> array:
+    """The cheapest arrows for notes at ms with pitches, in time order,
+    starting after an arrow on lane and a note of prev_pitch. One uniform
+    draw per note picks between arrows that cost the same.
+
+    A state is the lanes used by the chord so far and the lane of the last
+    note, as mask << 2 | lane. Outside of chords the mask is just the
+    lane, so there are only 4 states.
+    """
+    if not pitches:
+        return array('b')
+    costs = transition_costs(table)
+    gaps = [_SLOW] + [_CHORD if gap < CHORD_MS else _FAST if gap < FAST_MS else _SLOW
+                      for gap in map(sub, ms[1:], ms)]
+    rows = delta_rows(pitches, prev_pitch)
+    # the cheapest cost of ending on every lane and the state it ends in
+    c = [inf] * LANES
+    c[lane] = 0.0
+    c0, c1, c2, c3 = c
+    s = _SINGLES
+    chord = {}  # the cost of every state in the chord being played
+    # the state before every lane of every note on the cheapest way there,
+    # and the state before every state for notes in a chord
+    back = bytearray()
+    chord_back = {}
+    for i, (row, gap, roll) in enumerate(zip(rows, gaps, rolls)):
+        m = costs[row + gap]
+        tie = _TIES[int(roll * LANES)]
+        if gap != _CHORD:
+            n0, b0 = _cheapest(c0 + m[0], c1 + m[1], c2 + m[2], c3 + m[3])
+            n1, b1 = _cheapest(c0 + m[4], c1 + m[5], c2 + m[6], c3 + m[7])
+            n2, b2 = _cheapest(c0 + m[8], c1 + m[9], c2 + m[10], c3 + m[11])
+            n3, b3 = _cheapest(c0 + m[12], c1 + m[13], c2 + m[14], c3 + m[15])
+            back += bytes((s[b0], s[b1], s[b2], s[b3]))
+            c0, c1, c2, c3 = n0 + tie[0], n1 + tie[1], n2 + tie[2], n3 + tie[3]
+            s = _SINGLES
+            chord = {}
+            continue
+        if not chord:
+            chord = {state: cost for state, cost in zip(s, (c0, c1, c2, c3)) if cost < inf}
+        next_chord = {}
+        prev_states = {}
+        for state, cost in chord.items():
+            for move, b, next_state in _CHORD_MOVES[state]:
+                next_cost = cost + m[move] + tie[b]
+                if next_cost < next_chord.get(next_state, inf):
+                    next_chord[next_state] = next_cost
+                    prev_states[next_state] = state
+        chord = next_chord
+        chord_back[i] = prev_states
+        back += bytes(LANES)
+        c = [inf] * LANES
+        s = list(_SINGLES)
+        for state, cost in chord.items():
+            if cost < c[state & 3]:
+                c[state & 3] = cost
+                s[state & 3] = state
+        c0, c1, c2, c3 = c
+    _, lane = _cheapest(c0, c1, c2, c3)
+    state = s[lane]
+    arrows = array('b', bytes(len(pitches)))
+    for i in range(len(pitches) - 1, -1, -1):
+        arrows[i] = state & 3
+        state = chord_back[i][state] if i in chord_back else back[i * LANES + (state & 3)]
+    return arrows
+
+
+def repeated_chords(ms: Sequence[float], arrows: Sequence[int]) -> int:
+    """The number of chords of at most 4 notes with two notes on the same
+    arrow. Notes must be in time order.
+    """
+    repeated = 0
+    start = 0
+    for end in range(1, len(ms) + 1):
+        if end == len(ms) or ms[end] - ms[end - 1] >= CHORD_MS:
+            chord = arrows[start:end]
+            if 1 < len(chord) <= LANES and len(set(chord)) < len(chord):
+                repeated += 1
+            start = end
+    return repeated
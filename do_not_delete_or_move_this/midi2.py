@@ -3,56 +3,151 @@ Most of the code is copy-pasted from
 https://stackoverflow.com/questions/63105201/python-mido-how-to-get-note-starttime-stoptime-track-in-a-list
 which is under a CC-BY-SA license, as everything on stackoverflow is.
 """
+import io
+import os
+from array import array
+from dataclasses import dataclass
 from pprint import pprint
-from typing import Union
-
-from mido import MidiFile
-
-
-def process_midi(path: str):
-    mid = MidiFile(path)
-    mididict = []
-    output = []
-
-    # Put all note on/off in midinote as dictionary.
-    for i in mid:
-        if i.type == 'note_on' or i.type == 'note_off' or i.type == 'time_signature':
-            mididict.append(i.dict())
-    # change time values from delta to relative time.
-    mem1 = 0
-    for i in mididict:
-        time = i['time'] + mem1
-        i['time'] = time
-        mem1 = i['time']
-        # make every note_on with 0 velocity note_off
-        if i['type'] == 'note_on' and i['velocity'] == 0:
-            i['type'] = 'note_off'
-        # put note, starttime, stoptime, as nested list in a list.
-        # format is [type, note, time, channel]
-        mem2 = []
-        if i['type'] == 'note_on' or i['type'] == 'note_off':
-            mem2.append(i['type'])
-            mem2.append(i['note'])
-            mem2.append(i['time'])
-            mem2.append(i['channel'])
-            mem2.append(i['velocity'])
-            output.append(mem2)
-        # put timesignatures
-        if i['type'] == 'time_signature':
+from typing import TYPE_CHECKING, BinaryIO, Collection, Optional, Union
+
+from do_not_delete_or_move_this import smf
+from do_not_delete_or_move_this.notes import EventColumns, NOTE_ON, NOTE_OFF
+from do_not_delete_or_move_this.tempo_map import TempoMap, DEFAULT_TEMPO
+
+if TYPE_CHECKING:
+    from mido import MidiFile, MidiTrack
+
+# a path, the bytes of a MIDI file or a binary file object
+MidiSource = Union[str, os.PathLike, bytes, BinaryIO]
+
+
+@dataclass
+class MidiData:
+    """Everything the chart generator needs from a MIDI file.
+    Built once by load_midi so the file is only opened and decoded once.
+    notes is in type, note, time, channel, velocity format, time in seconds.
+    """
+    tempo: int  # microseconds per beat at the start of the song
+    ticks_per_beat: int
+    notes: EventColumns
+    tempo_map: TempoMap
+
+    @property
+    def spb(self) -> float:
+        return mspt_to_spb(self.tempo)
+
+
+def load_midi(path: MidiSource, channels: Optional[Collection[int]] = None,
+              tracks: Optional[Collection[int]] = None, use_mido: bool = False,
+              workers: Optional[int] = None) -> MidiData:
+    """Open and decode a MIDI file in a single pass over its events.
+    Times are kept in ticks until the tempo map is known, then converted
+    to seconds.
+    Only notes on the given channels and in the given tracks are kept
+    (None keeps everything). Tempo and time signature events are read
+    from every track.
+    The file is read with the raw reader in smf, or with mido if use_mido
+    is set or the raw reader can't handle it. Both give the same result.
+    workers is the number of processes the raw reader decodes tracks in,
+    see smf.read_smf_bytes.
+    """
+    if hasattr(path, 'read'):
+        # read it once, mido may need it again
+        path = path.read()
+    if not use_mido:
+        try:
+            raw = smf.read_smf(path, channels, tracks, workers)
+        except smf.SmfError:
             pass
-            # mem2.append(i['type'])
-            # mem2.append(i['numerator'])
-            # mem2.append(i['denominator'])
-            # mem2.append(i['time'])
-            # output.append(mem2)
-    return output
-    # viewing the midimessages.
-    # for i in output:
-    #     print(i)
-    # print(mid.ticks_per_beat)
-
-
-def isolate_midi_channels(data: list[list[str, int, Union[int, float], int]]):
+        else:
+            return _midi_data(raw.ticks_per_beat, raw.notes, raw.ticks, raw.tempos, raw.meters)
+    return load_midi_mido(path, channels, tracks)
+
+
+def load_midi_mido(path: MidiSource, channels: Optional[Collection[int]] = None,
+                   tracks: Optional[Collection[int]] = None) -> MidiData:
+    """load_midi through mido's merged track iterator.
+    """
+    from mido import merge_tracks
+
+    mid = open_midi(path)
+    if tracks is not None:
+        mid_tracks = [track if i in tracks else _meta_only(track) for i, track in enumerate(mid.tracks)]
+    else:
+        mid_tracks = mid.tracks
+    tempos = []
+    meters = []
+    output = EventColumns()
+    ticks = array('q')
+    tick = 0
+    for i in merge_tracks(mid_tracks):
+        tick += i.time
+        if i.type == 'note_on' or i.type == 'note_off':
+            if channels is not None and i.channel not in channels:
+                continue
+            # make every note_on with 0 velocity note_off
+            if i.type == 'note_on' and i.velocity != 0:
+                note_type = NOTE_ON
+            else:
+                note_type = NOTE_OFF
+            # format is type, note, time, channel, velocity
+            output.append(note_type, i.note, 0.0, i.channel, i.velocity)
+            ticks.append(tick)
+        elif i.type == 'set_tempo':
+            tempos.append((tick, i.tempo))
+        elif i.type == 'time_signature':
+            meters.append((tick, i.numerator, i.denominator))
+    return _midi_data(mid.ticks_per_beat, output, ticks, tempos, meters)
+
+
+def _midi_data(ticks_per_beat: int, notes: EventColumns, ticks: array,
+               tempos: list[tuple[int, int]], meters: list[tuple[int, int, int]]) -> MidiData:
+    """Build the tempo map and convert the note ticks to seconds.
+    """
+    tempo_map = TempoMap(ticks_per_beat, tempos, meters)
+    notes.time = tempo_map.ticks_to_seconds(ticks)
+    return MidiData(tempo_map.tempos[0], ticks_per_beat, notes, tempo_map)
+
+
+def _meta_only(track: 'MidiTrack') -> 'MidiTrack':
+    """The meta messages of a track, for tracks whose notes aren't wanted.
+    """
+    from mido import MidiTrack
+
+    meta_track = MidiTrack()
+    delta = 0
+    for msg in track:
+        delta += msg.time
+        if msg.is_meta:
+            meta_track.append(msg.copy(time=delta))
+            delta = 0
+    return meta_track
+
+
+def open_midi(path: MidiSource) -> 'MidiFile':
+    from mido import MidiFile
+
+    if isinstance(path, (bytes, bytearray, memoryview)):
+        return MidiFile(file=io.BytesIO(path))
+    if hasattr(path, 'read'):
+        return MidiFile(file=path)
+    return MidiFile(path)
+
+
+def read_midi_bytes(path: MidiSource) -> bytes:
+    if isinstance(path, (bytes, bytearray, memoryview)):
+        return bytes(path)
+    if hasattr(path, 'read'):
+        return path.read()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def process_midi(path: str) -> EventColumns:
+    return load_midi(path).notes
+
+
+def isolate_midi_channels(data: EventColumns):
     """Return a tuple.
     [0]: dict: note_data, keys are channel
     [1]: same as 0 but for special notes
@@ -63,7 +158,7 @@ def isolate_midi_channels(data: list[list[str, int, Union[int, float], int]]):
     midi_channel_nums = set()
     midi_channel_nums_specific = set()
     for note in data:
-        if note[0] != 'note_on':
+        if note[0] != NOTE_ON:
             continue
         if note[1] != 72:  # the non special note
             if note[3] not in midi_channel_nums:
@@ -83,12 +178,11 @@ def get_tempo(mid):
     for msg in mid:  # Search for tempo
         if msg.type == 'set_tempo':
             return msg.tempo
-    return 500000  # If not found return default tempo
+    return DEFAULT_TEMPO  # If not found return default tempo
 
 
 def get_tempo_from_file(path):
-    mid = MidiFile(path)
-    return get_tempo(mid)
+    return load_midi(path).tempo
 
 
 def mspt_to_spb(num: float) -> float:
@@ -97,13 +191,12 @@ def mspt_to_spb(num: float) -> float:
 
 
 def obtain_spb(path):
-    mspt = get_tempo_from_file(path)
-    return mspt_to_spb(mspt)
+    return load_midi(path).spb
 
 if __name__ == '__main__':
     # pm = process_midi('goof.mid')
     # print(get_tempo_from_file('goof.mid'))
-    print(obtain_spb('Test_midifile.mid'))
+    print(load_midi('Test_midifile.mid').spb)
     # bm = process_midi(pm)
     # bm = isolate_midi_channels(pm)
    #  pprint(pm)
@@ -1,105 +1,124 @@
 """Bruh moment
 """
 # from pprint import pprint
+from collections import deque
 from pprint import pprint
-from typing import Union
+from typing import Iterable
 
 from do_not_delete_or_move_this import midi2 as mid
+from do_not_delete_or_move_this.notes import EventColumns, NoteColumns, NOTE_ON
 
 
-def main(processed_mid_data):
-    lm = isolate_channels(processed_mid_data)
-    # pprint(lm)
-    jm = format_indv_pitch_bulk(lm)
-    # pprint(jm)
-    return jm
+def main(midi_data: mid.MidiData):
+    return pair_notes(midi_data.notes)
 
 
-def isolate_channels(mid_data: list[list[str, int, Union[int, float], int]]) -> list[list]:
-    """Isolate midi channel.
-    What it returns:
-    [[channel data[note data]], [channel data[note data]]]
+def pair_notes(mid_data: EventColumns) -> list[NoteColumns]:
+    """Pair note on and note off events in a single pass.
+    mid_data must be in time order. What it returns:
+    [channel data, channel data], where channel data is a NoteColumns
+    in time, pitch, vel, dur format, ordered by time then pitch.
+    Cases:
+        - First note is off? Don't count it
+        - Last note is on? Don't count it.
+        - Two ons in a row? Don't count the second one.
     """
-    isolated_so_far = {}
-    for note in mid_data:
-        if note[3] not in isolated_so_far:
-            isolated_so_far[note[3]] = []
-        isolated_so_far[note[3]].append(note)
-    highest_channel = max(int(mm) for mm in isolated_so_far.keys()) + 1
-    isolated_channel_list = [[] for _ in range(0, highest_channel)]
-    for key, item in isolated_so_far.items():
-        isolated_channel_list[int(key)] = item
+    pairer = NotePairer()
+    pairer.feed(mid_data)
+    pairer.finish()
+    exported = pairer.exported
+    if not exported:
+        return []
+    isolated_channel_list = [NoteColumns() for _ in range(0, max(exported) + 1)]
+    for channel, channel_export in exported.items():
+        isolated_channel_list[channel] = channel_export
     return isolated_channel_list
 
 
-def format_indv_pitch_bulk(mid_data) -> list[list[list]]:
-    """Start with the entire thing
-    end with the entire thing
+class NotePairer:
+    """Pairs note on and note off events like pair_notes, but can be fed
+    the events a few at a time.
+    A note is appended to exported[channel] once it has ended and no note
+    of its channel that comes before it can still show up. Until then it
+    waits in pending, which holds the notes of every channel in output
+    order. Rows may be taken out of exported between feeds.
+    A note held for more than max_hold seconds is dropped at the end of a
+    feed as if it never ended, so that it can't hold back every note after
+    it for the rest of the song.
     """
-    outer_export = []
-    for channel in mid_data:
-        channel_pitch_export = []
-        seperated_pitch_data = separate_pitches(channel)
-        for individual_pitch in seperated_pitch_data:
-            indv_p = format_channel_indv_pitch(individual_pitch)
-            channel_pitch_export.append(indv_p)
-        channel_all_export = []
-        for indv_pitch in channel_pitch_export:
-            for indv_note in indv_pitch:
-                channel_all_export.append(indv_note)
-        sorted_channel_all = sorted(channel_all_export, key=lambda x: (x[0], x[1]))
-        outer_export.append(sorted_channel_all)
-    return outer_export
 
+    def __init__(self, max_hold: float = float('inf')):
+        self.max_hold = max_hold
+        self.active = {}  # (channel, pitch): note data of the note that is still held
+        self.pending: dict[int, deque] = {}  # channel: notes in output order, the ones in front may be done
+        self.exported: dict[int, NoteColumns] = {}
 
-def separate_pitches(channel_data) -> list[list]:
-    full_note_data = {}
-    for note in channel_data:
-        if note[1] not in full_note_data:
-            full_note_data[note[1]] = []
-        full_note_data[note[1]].append(note)
-    # generate it in complete random.
-    export_list = []
-    for _, item in full_note_data.items():
-        export_list.append(item)
-    return export_list
+    def feed(self, mid_data: Iterable[tuple]) -> None:
+        """Pair events in type, note, time, channel, velocity format.
+        """
+        active = self.active
+        pending = self.pending
+        exported = self.exported
+        note = None
+        for note in mid_data:
+            channel = note[3]
+            if channel not in pending:
+                pending[channel] = deque()
+                exported[channel] = NoteColumns()
+            queue = pending[channel]
+            # anything done that started before now can't be passed by a later note
+            while queue and queue[0][3] is not None and queue[0][0] < note[2]:
+                exported[channel].append(*queue.popleft())
+            key = (channel, note[1])
+            if note[0] == NOTE_ON:
+                if key in active:
+                    continue
+                new_data = [note[2], note[1], note[4], None]  # time, pitch, vel, dur
+                active[key] = new_data
+                _queue_in_order(queue, new_data)
+            elif key in active:
+                on_note_data = active.pop(key)
+                on_note_data[3] = note[2] - on_note_data[0]
+        if note is not None and self.max_hold != float('inf'):
+            self._drop_held(note[2])
 
+    def _drop_held(self, now: float) -> None:
+        """Drop the notes held since before now - max_hold that are first in
+        their channel, and export the done notes they held back.
+        """
+        for channel, queue in self.pending.items():
+            while queue and queue[0][0] < now:
+                front = queue[0]
+                if front[3] is not None:
+                    self.exported[channel].append(*queue.popleft())
+                elif front[0] < now - self.max_hold:
+                    queue.popleft()
+                    del self.active[(channel, front[1])]
+                else:
+                    break
 
-def format_channel_indv_pitch(channel_data):
-    """Will output:
-    [time, pitch, vel, dur]
-    Cases:
-        - First note is off? Don't count it
-        - Last note is on? Don't count it.
-        - Two ons in a row? Don't count the second one.
+    def finish(self) -> None:
+        """Export every note that ended. Notes that never ended are dropped.
+        """
+        for channel, queue in self.pending.items():
+            channel_export = self.exported[channel]
+            for n in queue:
+                if n[3] is not None:
+                    channel_export.append(*n)
+            queue.clear()
+        self.active.clear()
+
+
+def _queue_in_order(queue: deque, note_data: list) -> None:
+    """Queue note_data, keeping notes that start together sorted by pitch.
     """
-    notes_so_far = []
-    last_on_note_data = []
-    prev_note_state = ''
-    for note in channel_data:
-        try:
-            if prev_note_state == '' or prev_note_state == 'note_off':
-                # requires that notes be ON or skipped
-                if note[0] == 'note_on':
-                    last_on_note_data = [note[2], note[1], note[4]]  # time, pitch, vel
-                    prev_note_state = 'note_on'
-                else:
-                    continue
-            if prev_note_state == 'note_on':
-                # requires that notes be OFF or skipped.
-                if note[0] == 'note_off':
-                    dur = note[2] - last_on_note_data[0]
-                    new_data = last_on_note_data + [dur]
-                    notes_so_far.append(new_data)
-                    prev_note_state = 'note_off'
-                else:
-                    continue
-        except IndexError:
-            continue
-    return notes_so_far
+    i = len(queue)
+    while i > 0 and queue[i - 1][0] == note_data[0] and queue[i - 1][1] > note_data[1]:
+        i -= 1
+    queue.insert(i, note_data)
 
 
 if __name__ == '__main__':
-    pm = mid.process_midi('tmf.mid')
+    pm = mid.load_midi('tmf.mid')
     # pprint(pm)
     pprint(main(pm))
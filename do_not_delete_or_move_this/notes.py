@@ -0,0 +1,69 @@
+"""Compact column stores for notes moving through the pipeline.
+
+Every column is an array.array, so a note costs a handful of bytes
+instead of a list of boxed objects. Iterating a store yields one tuple
+per row, which keeps note[0] style indexing working.
+"""
+from array import array
+
+NOTE_OFF = 0
+NOTE_ON = 1
+
+
+class _Columns:
+    """A table where every field is its own typed array.
+    FIELDS lists (name, array typecode) pairs in row order.
+    """
+    FIELDS: tuple[tuple[str, str], ...] = ()
+
+    def __init__(self, *columns):
+        if not columns:
+            columns = tuple(array(code) for _, code in self.FIELDS)
+        for (name, _), column in zip(self.FIELDS, columns):
+            setattr(self, name, column)
+
+    def columns(self) -> tuple:
+        return tuple(getattr(self, name) for name, _ in self.FIELDS)
+
+    def append(self, *row) -> None:
+        for column, value in zip(self.columns(), row):
+            column.append(value)
+
+    def clear(self) -> None:
+        for column in self.columns():
+            del column[:]
+
+    def __len__(self) -> int:
+        return len(getattr(self, self.FIELDS[0][0]))
+
+    def __iter__(self):
+        return zip(*self.columns())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return type(self)(*(column[index] for column in self.columns()))
+        return tuple(column[index] for column in self.columns())
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.columns() == other.columns()
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({len(self)} rows)'
+
+
+class EventColumns(_Columns):
+    """Note on/off events. kind is NOTE_ON or NOTE_OFF, time is in seconds.
+    """
+    FIELDS = (('kind', 'b'), ('pitch', 'B'), ('time', 'd'), ('channel', 'B'), ('velocity', 'B'))
+
+
+class NoteColumns(_Columns):
+    """Paired notes in time, pitch, vel, dur format. Times are in seconds.
+    """
+    FIELDS = (('time', 'd'), ('pitch', 'B'), ('vel', 'B'), ('dur', 'd'))
+
+
+class ChartColumns(_Columns):
+    """Charted notes in ms, arrow, sus format.
+    """
+    FIELDS = (('ms', 'd'), ('arrow', 'b'), ('sus', 'd'))
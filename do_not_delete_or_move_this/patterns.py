@@ -0,0 +1,219 @@
+"""Arrow patterns as lane transition tables.
+
+A PatternTable gives, for every pitch difference between a note and the
+one before it (clamped to MAX_DELTA semitones either way) and every lane
+the previous arrow is on, the chance of the next arrow landing on each
+lane. The chances are stored as cumulative thresholds, so picking an
+arrow from a uniform draw is one binary search.
+
+A style is a function (delta, previous lane, jack chance) -> [(lane,
+chance), ...] that tables are built from, once per jack chance:
+
+    default     up moves right and down moves left by 1 or 2 lanes,
+                wrapping around, a repeated pitch is a jack unless
+                skipped with the jack chance (how the generator always
+                worked, so old seeds give the same charts)
+    stream      never a jack, and no wrapping around: arrows bounce
+                off the edges so patterns roll back and forth
+    jacky       like default, but pitches a semitone or two apart are
+                jacks half of the time
+
+Other styles can be added with register_style, or loaded from a JSON
+file with load_table.
+"""
+import json
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from operator import sub
+from typing import Callable, Iterable, Iterator, Sequence
+
+# chance out of 7 for a pitch difference (capped at 8) to move the arrow by two
+SEED_CHANCES = (0, 1, 1, 1, 1, 2, 2, 2, 3)
+# pitch differences past this many semitones are treated as this many
+MAX_DELTA = 8
+LANES = 4
+
+Style = Callable[[int, int, float], Sequence[tuple[int, float]]]
+
+
+def _row(delta: int) -> int:
+    return (min(max(delta, -MAX_DELTA), MAX_DELTA) + MAX_DELTA) * LANES
+
+
+# the first row of every pitch delta from -255 to 255, negative deltas index from the end
+_ROWS = [_row(delta) for delta in range(256)] + [_row(delta) for delta in range(-256, 0)]
+
+
+def delta_rows(pitches: Sequence[int], prev_pitch: int = 60) -> Iterator[int]:
+    """The first row of the pitch delta of every note from the one before
+    it, starting after a note of prev_pitch.
+    """
+    return map(_ROWS.__getitem__, map(sub, pitches, [prev_pitch, *pitches[:-1]]))
+
+
+class PatternTable:
+    """Lane transition chances, indexed by pitch delta and previous lane.
+    rows[(delta + MAX_DELTA) * LANES + lane] lists (next lane, chance)
+    pairs in the order draws are matched against them: a draw below the
+    first chance picks the first lane, and so on.
+    """
+
+    def __init__(self, rows: Sequence[Sequence[tuple[int, float]]]):
+        if len(rows) != (2 * MAX_DELTA + 1) * LANES:
+            raise ValueError(f'a pattern table needs {(2 * MAX_DELTA + 1) * LANES} rows, not {len(rows)}')
+        self.thresholds = []
+        self.lanes = []
+        for row in rows:
+            if any(not 0 <= lane < LANES for lane, _ in row):
+                raise ValueError(f'lanes must be from 0 to {LANES - 1}')
+            if any(chance < 0 for _, chance in row):
+                raise ValueError("chances can't be negative")
+            thresholds = array('d', accumulate(chance for _, chance in row))
+            if not thresholds or abs(thresholds[-1] - 1) > 1e-9:
+                raise ValueError('the chances of every row must add up to 1')
+            # so rounding in the sum can't let a draw fall past the last lane
+            thresholds[-1] = float('inf')
+            self.thresholds.append(thresholds)
+            self.lanes.append(bytes(lane for lane, _ in row))
+
+    @classmethod
+    def from_style(cls, style: Style, jack_chance: float) -> 'PatternTable':
+        return cls([style(delta, lane, jack_chance)
+                    for delta in range(-MAX_DELTA, MAX_DELTA + 1) for lane in range(LANES)])
+
+    def sample(self, pitches: Sequence[int], rolls: Iterable[float], lane: int, prev_pitch: int = 60) -> array:
+        """Pick the arrow of every note from the pitches of the notes and
+        one uniform draw per note, starting after an arrow on lane and a
+        note of prev_pitch.
+        """
+        rows = delta_rows(pitches, prev_pitch)
+        thresholds = self.thresholds
+        lanes = self.lanes
+        arrows = []
+        append = arrows.append
+        for row, roll in zip(rows, rolls):
+            i = row + lane
+            lane = lanes[i][bisect_right(thresholds[i], roll)]
+            append(lane)
+        return array('b', arrows)
+
+    def chances(self, delta: int, lane: int) -> list[float]:
+        """The chance of the next arrow landing on every lane, after one on
+        lane for a note delta semitones away.
+        """
+        i = _row(delta) + lane
+        chances = [0.0] * LANES
+        prev = 0.0
+        for next_lane, threshold in zip(self.lanes[i], self.thresholds[i][:-1]):
+            chances[next_lane] += threshold - prev
+            prev = threshold
+        chances[self.lanes[i][-1]] += 1 - prev
+        return chances
+
+    def next_lane(self, delta: int, lane: int, roll: float) -> int:
+        """The arrow after one on lane for a note delta semitones away,
+        for one uniform draw.
+        """
+        i = _row(delta) + lane
+        return self.lanes[i][bisect_right(self.thresholds[i], roll)]
+
+
+def default_style(delta: int, lane: int, jack_chance: float) -> list[tuple[int, float]]:
+    if delta:
+        # the greater the chance, the higher that it is a two
+        two = (SEED_CHANCES[abs(delta)] + 1) / 7
+        step = 1 if delta > 0 else -1
+        return [((lane + 2 * step) % LANES, two), ((lane + step) % LANES, 1 - two)]
+    # a skipped jack moves anywhere from 2 left to 2 right
+    return [((lane + offset) % LANES, jack_chance / 5) for offset in range(-2, 3)] + [(lane, 1 - jack_chance)]
+
+
+def stream_style(delta: int, lane: int, jack_chance: float) -> list[tuple[int, float]]:
+    def bounce(step: int) -> int:
+        target = lane + step
+        target = -target if target < 0 else 2 * (LANES - 1) - target if target >= LANES else target
+        # a move of two that bounces back to where it started is a move of one
+        return bounce(step // 2) if target == lane else target
+
+    if delta:
+        step = 1 if delta > 0 else -1
+        two = SEED_CHANCES[abs(delta)] / 7
+        return [(bounce(2 * step), two), (bounce(step), 1 - two)]
+    # a repeated pitch keeps rolling, left or right
+    return [(bounce(-1), 0.5), (bounce(1), 0.5)]
+
+
+def jacky_style(delta: int, lane: int, jack_chance: float) -> list[tuple[int, float]]:
+    if 0 < abs(delta) <= 2:
+        return [(lane, 0.5)] + [(next_lane, chance / 2) for next_lane, chance in default_style(delta, lane, 0)]
+    return default_style(delta, lane, jack_chance)
+
+
+STYLES: dict[str, Style] = {"default": default_style, "stream": stream_style, "jacky": jacky_style}
+
+
+def register_style(name: str, style: Style) -> None:
+    """Make a style available by name, e.g. for "pattern" in settings.json.
+    """
+    STYLES[name] = style
+    style_table.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def style_table(name: str, jack_chance: float) -> PatternTable:
+    """The table of a named style, built once for every jack chance.
+    """
+    return PatternTable.from_style(STYLES[name], jack_chance)
+
+
+def pattern_table(pattern: str, jack_chance: float) -> PatternTable:
+    """The table for the "pattern" setting: the name of a style, or the
+    path of a JSON table for load_table.
+    """
+    if pattern in STYLES:
+        return style_table(pattern, jack_chance)
+    if pattern.endswith('.json'):
+        return load_table(pattern)
+    raise ValueError(f'unknown pattern {pattern!r}, expected one of {", ".join(STYLES)} or a .json file')
+
+
+def load_table(path: str) -> PatternTable:
+    """Load a table from a JSON file. "steps" maps a pitch delta to
+    [[step, chance], ...], the lanes to move by from any lane:
+
+        {"steps": {"0": [[0, 0.5], [1, 0.25], [-1, 0.25]], "1": [[1, 1]], "2": [[1, 0.5], [2, 0.5]], ...}}
+
+    "lanes" maps a pitch delta to one [[next lane, chance], ...] list per
+    previous lane instead. Deltas go from -8 to 8. A negative delta that
+    isn't given mirrors the positive one.
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    if "lanes" in spec:
+        by_delta = {int(delta): rows for delta, rows in spec["lanes"].items()}
+        rows = []
+        for delta in range(-MAX_DELTA, MAX_DELTA + 1):
+            if delta in by_delta:
+                delta_rows = [[(lane, chance) for lane, chance in row] for row in by_delta[delta]]
+            elif -delta in by_delta:
+                # mirrored: the previous and next lanes are flipped left to right
+                delta_rows = [[(LANES - 1 - lane, chance) for lane, chance in row] for row in by_delta[-delta][::-1]]
+            else:
+                delta_rows = []
+            if len(delta_rows) != LANES:
+                raise ValueError(f'{path} has no {LANES} rows for delta {delta}')
+            rows.extend(delta_rows)
+        return PatternTable(rows)
+    steps = {int(delta): row for delta, row in spec["steps"].items()}
+    rows = []
+    for delta in range(-MAX_DELTA, MAX_DELTA + 1):
+        if delta in steps:
+            row = steps[delta]
+        elif -delta in steps:
+            row = [[-step, chance] for step, chance in steps[-delta]]
+        else:
+            raise ValueError(f'{path} has no steps for delta {delta}')
+        rows.extend([((lane + step) % LANES, chance) for step, chance in row] for lane in range(LANES))
+    return PatternTable(rows)
@@ -0,0 +1,319 @@
+"""A Standard MIDI File reader that doesn't go through mido.
+
+mido builds a Message object for every event in the file. This walks
+the MTrk chunks of a memory-mapped file byte by byte instead and only
+decodes what the chart needs: note on/off, tempo and time signature.
+Everything else is skipped over.
+
+It reads files the way mido does (same running status rules, same
+track merge order), so load_midi gives the same output either way.
+Files it can't read like mido does, such as SMPTE timed or malformed
+files, raise SmfError so the caller can fall back to mido.
+
+Tracks are decoded independently in ticks, in parallel for big files,
+then merged in tick order. Times are left for the tempo map to convert.
+"""
+import heapq
+import mmap
+import os
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import TYPE_CHECKING, Collection, Iterator, Optional, Union
+
+from do_not_delete_or_move_this.notes import EventColumns, NOTE_ON, NOTE_OFF
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+# mido refuses meta and sysex messages longer than this
+MAX_MESSAGE_LENGTH = 1000000
+# smaller files are decoded in this process, starting workers would cost more than it saves
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+
+# data bytes after each status byte, 0xff for status bytes mido rejects
+_DATA_LENGTHS = bytes([2] * 0x40 + [1] * 0x20 + [2] * 0x10 +
+                      [0xff, 1, 2, 1, 0xff, 0xff, 0, 0xff, 0, 0xff, 0, 0, 0, 0xff, 0, 0xff])
+
+
+_pool: Optional['ProcessPoolExecutor'] = None
+_pool_workers = 0
+
+
+class SmfError(ValueError):
+    """The file can't be read without mido.
+    """
+
+
+@dataclass
+class RawMidi:
+    """The events of a MIDI file in tick time.
+    notes has its time column empty, ticks holds the tick of every note.
+    """
+    ticks_per_beat: int
+    notes: EventColumns
+    ticks: array
+    tempos: list[tuple[int, int]]
+    meters: list[tuple[int, int, int]]
+
+
+def read_smf(path: Union[str, os.PathLike, bytes], channels: Optional[Collection[int]] = None,
+             tracks: Optional[Collection[int]] = None, workers: Optional[int] = None) -> RawMidi:
+    """Read a MIDI file from a path (memory-mapped) or from its bytes.
+    channels and tracks limit the notes kept like in load_midi.
+    """
+    with open_smf(path) as data:
+        return read_smf_bytes(data, channels, tracks, workers)
+
+
+@contextmanager
+def open_smf(path: Union[str, os.PathLike, bytes]) -> Iterator:
+    """Memory-map the file at path, or pass the bytes of a file through.
+    """
+    if isinstance(path, (bytes, bytearray, memoryview)):
+        yield path
+        return
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            raise SmfError('empty file')
+    with data:
+        yield data
+
+
+def read_smf_bytes(data, channels: Optional[Collection[int]] = None,
+                   tracks: Optional[Collection[int]] = None, workers: Optional[int] = None) -> RawMidi:
+    """Read a MIDI file from anything that indexes to bytes.
+    Every track is decoded on its own, in a pool of workers processes if
+    that is more than one. By default files of PARALLEL_MIN_BYTES or more
+    use one process per core, unless this already runs in a worker.
+    """
+    division, chunks = _read_header(data)
+    keep = _channel_flags(channels)
+    track_keeps = [keep if tracks is None or index in tracks else None for index in range(len(chunks))]
+    workers = _pool_size(workers, len(data), len(chunks))
+    if workers > 1:
+        decoded = list(_get_pool(workers).map(_decode_track_bytes, [bytes(data[pos:end]) for pos, end in chunks],
+                                              track_keeps))
+    else:
+        decoded = [_decode_track(data, pos, end, track_keep) for (pos, end), track_keep in zip(chunks, track_keeps)]
+
+    note_tracks = [(ticks, columns) for ticks, columns, _, _ in decoded if ticks]
+    if len(note_tracks) == 1:
+        ticks, columns = note_tracks[0]
+    else:
+        ticks = array('q')
+        columns = EventColumns()
+        for track_ticks, track_columns in note_tracks:
+            ticks.extend(track_ticks)
+            for column, track_column in zip(columns.columns(), track_columns.columns()):
+                column.extend(track_column)
+        if note_tracks:
+            # every track is already in tick order, so this merges them.
+            # Like mido's merge_tracks it is stable, ties keep track order
+            order = sorted(range(len(ticks)), key=ticks.__getitem__)
+            ticks = array('q', map(ticks.__getitem__, order))
+            columns = EventColumns(*(array(column.typecode, map(column.__getitem__, order)) if column else column
+                                     for column in columns.columns()))
+    tempos = [tempo for _, _, track_tempos, _ in decoded for tempo in track_tempos]
+    meters = [meter for _, _, _, track_meters in decoded for meter in track_meters]
+    tempos.sort(key=itemgetter(0))
+    meters.sort(key=itemgetter(0))
+    return RawMidi(division, columns, ticks, tempos, meters)
+
+
+def iter_smf_notes(data, channels: Optional[Collection[int]] = None,
+                   tracks: Optional[Collection[int]] = None) -> Iterator[tuple[int, int, int, int, int]]:
+    """Yield the notes of a MIDI file in the order read_smf_bytes keeps
+    them, as (tick, kind, pitch, channel, velocity), while the file is
+    read. Only one event per track is held at a time. Tempo and time
+    signature events are skipped, read them with read_smf_bytes first.
+    """
+    division, chunks = _read_header(data)
+    keep = _channel_flags(channels)
+    track_notes = [_iter_track(data, pos, end, keep if tracks is None or index in tracks else None, [], [])
+                   for index, (pos, end) in enumerate(chunks)]
+    try:
+        # heapq.merge keeps ties in track order, like the stable sort
+        yield from heapq.merge(*track_notes, key=itemgetter(0))
+    except IndexError:
+        raise SmfError('truncated track')
+
+
+def _read_header(data) -> tuple[int, list[tuple[int, int]]]:
+    """Return the ticks per beat and where the data of every track starts
+    and ends.
+    """
+    try:
+        name, size, file_format, track_count, division = struct.unpack_from('>4sLhhh', data)
+    except struct.error:
+        raise SmfError('truncated header')
+    if name != b'MThd' or size < 6:
+        raise SmfError('not a MIDI file')
+    if division < 0:
+        raise SmfError('SMPTE time division')
+    chunks = []
+    pos = 8 + size
+    for index in range(track_count):
+        try:
+            name, size = struct.unpack_from('>4sL', data, pos)
+        except struct.error:
+            raise SmfError(f'track {index} is missing')
+        if name != b'MTrk':
+            raise SmfError(f'no MTrk header at track {index}')
+        chunks.append((pos + 8, pos + 8 + size))
+        pos += 8 + size
+    return division, chunks
+
+
+def _channel_flags(channels: Optional[Collection[int]]) -> bytes:
+    return bytes(1 if channels is None or channel in channels else 0 for channel in range(16))
+
+
+def _decode_track(data, pos: int, end: int, keep: Optional[bytes]) -> tuple[array, EventColumns, list, list]:
+    """Decode one MTrk chunk. Return the ticks and columns of its notes,
+    and its tempo and time signature events.
+    """
+    columns = EventColumns()
+    kinds, pitches, _, note_channels, velocities = columns.columns()
+    ticks = array('q')
+    tempos = []
+    meters = []
+    try:
+        for tick, kind, pitch, channel, velocity in _iter_track(data, pos, end, keep, tempos, meters):
+            kinds.append(kind)
+            pitches.append(pitch)
+            note_channels.append(channel)
+            velocities.append(velocity)
+            ticks.append(tick)
+    except IndexError:
+        raise SmfError('truncated track')
+    return ticks, columns, tempos, meters
+
+
+def _decode_track_bytes(track: bytes, keep: Optional[bytes]) -> tuple[array, EventColumns, list, list]:
+    return _decode_track(track, 0, len(track), keep)
+
+
+def _pool_size(workers: Optional[int], size: int, track_count: int) -> int:
+    if workers is None:
+        # only big files are worth it, and the pool isn't started from inside other workers
+        # or from a frozen (PyInstaller) build, whose workers would start the app again
+        if size < PARALLEL_MIN_BYTES or _in_worker() or getattr(sys, 'frozen', False):
+            return 1
+        workers = os.cpu_count() or 1
+    return min(workers, track_count)
+
+
+def _in_worker() -> bool:
+    import multiprocessing
+
+    return multiprocessing.parent_process() is not None
+
+
+def _get_pool(workers: int) -> 'ProcessPoolExecutor':
+    """The pool of track decoders, kept for the next file.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(workers)
+        _pool_workers = workers
+    return _pool
+
+
+def _iter_track(data, pos: int, end: int, keep: Optional[bytes],
+                tempos: list, meters: list) -> Iterator[tuple[int, int, int, int, int]]:
+    """Decode one MTrk chunk, yielding its notes as (tick, kind, pitch,
+    channel, velocity) and appending its tempo and time signature events
+    to tempos and meters. keep is a flag per channel, or None to skip
+    every note of this track.
+    """
+    tick = 0
+    status = 0
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        delta = byte & 0x7f
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            delta = (delta << 7) | (byte & 0x7f)
+        tick += delta
+
+        byte = data[pos]
+        if byte & 0x80:
+            pos += 1
+            if byte != 0xff:
+                status = byte
+        elif status:
+            byte = status
+            if byte == 0xf0 or byte == 0xf7:
+                # mido drops the data byte that repeated a sysex status
+                pos += 1
+        else:
+            raise SmfError('running status without a status byte')
+
+        kind = byte & 0xf0
+        if kind == 0x90 or kind == 0x80:
+            pitch = data[pos]
+            velocity = data[pos + 1]
+            pos += 2
+            if (pitch | velocity) & 0x80:
+                raise SmfError('data byte out of range')
+            channel = byte & 0x0f
+            if keep is not None and keep[channel]:
+                yield tick, NOTE_ON if kind == 0x90 and velocity else NOTE_OFF, pitch, channel, velocity
+        elif byte == 0xff:
+            meta_type = data[pos]
+            pos, length = _read_length(data, pos + 1)
+            if meta_type == 0x51:
+                if length < 3:
+                    raise SmfError('short set_tempo')
+                tempos.append((tick, data[pos] << 16 | data[pos + 1] << 8 | data[pos + 2]))
+            elif meta_type == 0x58:
+                if length < 4:
+                    raise SmfError('short time_signature')
+                meters.append((tick, data[pos], 2 ** data[pos + 1]))
+            pos += length
+        elif byte == 0xf0 or byte == 0xf7:
+            pos, length = _read_length(data, pos)
+            # mido checks the sysex data, without its f0 and f7 ends
+            body = bytes(data[pos:pos + length]).removeprefix(b'\xf0').removesuffix(b'\xf7')
+            if any(value & 0x80 for value in body):
+                raise SmfError('data byte out of range')
+            pos += length
+        else:
+            length = _DATA_LENGTHS[byte - 0x80]
+            if length == 0xff:
+                raise SmfError(f'undefined status byte 0x{byte:02x}')
+            if length and (data[pos] | data[pos + length - 1]) & 0x80:
+                raise SmfError('data byte out of range')
+            pos += length
+    if pos != end:
+        raise SmfError('message runs past the end of its track')
+
+
+def _read_length(data, pos: int) -> tuple[int, int]:
+    """Read the variable length of a meta or sysex message.
+    Return the position after it and the length.
+    """
+    length = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        length = (length << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            break
+    if length > MAX_MESSAGE_LENGTH:
+        raise SmfError('message too long')
+    if pos + length > len(data):
+        raise IndexError
+    return pos, length
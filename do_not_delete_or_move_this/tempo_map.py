@@ -0,0 +1,148 @@
+"""Tempo and time signature index of a MIDI file.
+
+Built once at parse time. Every lookup is a binary search over the
+tempo or meter changes, so songs with many tempo events stay cheap.
+Sections are bars: a 4/4 bar is the usual 16 step section.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+DEFAULT_TEMPO = 500000
+# how far past a boundary (in ms) a note counts as being in the next section
+SECTION_TOLERANCE = 0.1
+
+
+class TempoMap:
+    """Converts between ticks, ms and bars.
+    tempos is a list of (tick, microseconds per beat) and meters is a list
+    of (tick, numerator, denominator), both in tick order.
+    """
+    ARRAYS = ('tempo_ticks', 'tempos', 'tempo_ms', 'meter_ticks', 'meter_bars', 'numerators', 'denominators')
+
+    def __init__(self, ticks_per_beat: int, tempos: list[tuple[int, int]],
+                 meters: list[tuple[int, int, int]]):
+        self.ticks_per_beat = ticks_per_beat
+        self.tempo_ticks = array('q', [0])
+        self.tempos = array('l', [tempos[0][1] if tempos and tempos[0][0] == 0 else DEFAULT_TEMPO])
+        self.tempo_ms = array('d', [0.0])
+        for tick, tempo in tempos:
+            if tick == self.tempo_ticks[-1]:
+                # the last tempo at a tick wins
+                self.tempos[-1] = tempo
+                continue
+            self.tempo_ms.append(self.tick_to_ms(tick))
+            self.tempo_ticks.append(tick)
+            self.tempos.append(tempo)
+
+        self.meter_ticks = array('q', [0])
+        self.meter_bars = array('q', [0])
+        self.numerators = array('l', [4])
+        self.denominators = array('l', [4])
+        for tick, numerator, denominator in meters:
+            if numerator <= 0 or denominator <= 0:
+                # a bar with no beats can't be split into sections, so it is ignored
+                continue
+            if tick != self.meter_ticks[-1]:
+                bar_ticks = self._bar_ticks(len(self.meter_ticks) - 1)
+                # a change in the middle of a bar cuts that bar short
+                bars = -(-(tick - self.meter_ticks[-1]) // bar_ticks)
+                self.meter_bars.append(self.meter_bars[-1] + int(bars))
+                self.meter_ticks.append(tick)
+                self.numerators.append(numerator)
+                self.denominators.append(denominator)
+            else:
+                self.numerators[-1] = numerator
+                self.denominators[-1] = denominator
+
+    @classmethod
+    def from_arrays(cls, ticks_per_beat: int, arrays: dict[str, array]) -> 'TempoMap':
+        """Rebuild a tempo map from the arrays named in ARRAYS.
+        """
+        tempo_map = cls.__new__(cls)
+        tempo_map.ticks_per_beat = ticks_per_beat
+        for name in cls.ARRAYS:
+            setattr(tempo_map, name, arrays[name])
+        return tempo_map
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.ticks_per_beat == other.ticks_per_beat and \
+            all(getattr(self, name) == getattr(other, name) for name in self.ARRAYS)
+
+    @property
+    def has_changes(self) -> bool:
+        """Whether the tempo or the meter ever changes, or the meter isn't
+        a 16 step bar to begin with.
+        """
+        return len(self.tempos) > 1 or len(self.meter_ticks) > 1 or self.numerators[0] != self.denominators[0]
+
+    def _bar_ticks(self, i: int) -> float:
+        return self.ticks_per_beat * 4 * self.numerators[i] / self.denominators[i]
+
+    def tick_to_ms(self, tick: float) -> float:
+        i = bisect_right(self.tempo_ticks, tick) - 1
+        return self.tempo_ms[i] + (tick - self.tempo_ticks[i]) * self.tempos[i] / (self.ticks_per_beat * 1000)
+
+    def ticks_to_seconds(self, ticks: array) -> array:
+        """tick_to_ms(tick) / 1000 of every tick, which must be in order.
+        Walks the tempo changes once instead of searching for every tick.
+        """
+        seconds = array('d')
+        divisor = self.ticks_per_beat * 1000
+        lo = 0
+        for i, (tempo_tick, tempo, tempo_ms) in enumerate(zip(self.tempo_ticks, self.tempos, self.tempo_ms)):
+            hi = bisect_left(ticks, self.tempo_ticks[i + 1], lo) if i + 1 < len(self.tempo_ticks) else len(ticks)
+            seconds.extend((tempo_ms + (tick - tempo_tick) * tempo / divisor) / 1000 for tick in ticks[lo:hi])
+            lo = hi
+        return seconds
+
+    def ms_to_tick(self, ms: float) -> float:
+        i = max(bisect_right(self.tempo_ms, ms) - 1, 0)
+        return self.tempo_ticks[i] + (ms - self.tempo_ms[i]) * self.ticks_per_beat * 1000 / self.tempos[i]
+
+    def ms_to_ticks(self, ms: array) -> array:
+        """ms_to_tick of every time in ms, which must be in order.
+        Walks the tempo changes once like ticks_to_seconds.
+        """
+        ticks = array('d')
+        ticks_per_beat = self.ticks_per_beat
+        lo = 0
+        # times before the first tempo change use the first tempo, like ms_to_tick
+        for i, (tempo_tick, tempo, tempo_ms) in enumerate(zip(self.tempo_ticks, self.tempos, self.tempo_ms)):
+            hi = bisect_left(ms, self.tempo_ms[i + 1], lo) if i + 1 < len(self.tempo_ms) else len(ms)
+            ticks.extend(tempo_tick + (time - tempo_ms) * ticks_per_beat * 1000 / tempo for time in ms[lo:hi])
+            lo = hi
+        return ticks
+
+    def spb_at_ms(self, ms: float) -> float:
+        """Seconds per beat of the tempo playing at ms.
+        """
+        return self.tempos[max(bisect_right(self.tempo_ms, ms) - 1, 0)] / 1000000
+
+    def bar_at_tick(self, tick: float) -> int:
+        i = bisect_right(self.meter_ticks, tick) - 1
+        return self.meter_bars[i] + int((tick - self.meter_ticks[i]) // self._bar_ticks(i))
+
+    def bar_start_tick(self, bar: int) -> float:
+        i = bisect_right(self.meter_bars, bar) - 1
+        return self.meter_ticks[i] + (bar - self.meter_bars[i]) * self._bar_ticks(i)
+
+    def bar_start_ms(self, bar: int) -> float:
+        return self.tick_to_ms(self.bar_start_tick(bar))
+
+    def section_at_ms(self, ms: float) -> int:
+        """The section (bar) a note starting at ms belongs to.
+        """
+        return self.bar_at_tick(self.ms_to_tick(ms + SECTION_TOLERANCE))
+
+    def section_steps(self, bar: int) -> int:
+        """Length of a bar in steps (16th notes), shorter for a bar cut
+        short by a meter change.
+        """
+        ticks = self.bar_start_tick(bar + 1) - self.bar_start_tick(bar)
+        return round(ticks * 4 / self.ticks_per_beat)
+
+    def section_bpm(self, bar: int) -> float:
+        """The BPM playing at the start of a bar.
+        """
+        i = bisect_right(self.tempo_ticks, self.bar_start_tick(bar)) - 1
+        return round(60000000 / self.tempos[i], 3)
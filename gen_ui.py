@@ -1,8 +1,10 @@
+import multiprocessing
 import os
 from pathlib import Path
 from dataclasses import dataclass, field
 from typing import Optional
 from chart_gen import process
+from do_not_delete_or_move_this.patterns import STYLES
 from ui import DataclassUI
 
 @dataclass
@@ -18,6 +20,13 @@ class FCGInputs(DataclassUI):
     needs_voices: bool = field(default=True, metadata={'title': 'Needs voices (Just set this to true)'})
     scroll_speed: float = field(default=2, metadata={'title': 'Scroll speed'})
     swap_bf_en_2: bool = field(default=False, metadata={'title': "Swap P1 and P2's notes"})
+    seed: int = field(default=-1, metadata={'title': 'Seed (same seed, same chart)\n-1 for a different chart every time'})
+    en_channel: int = field(default=1, metadata={'title': 'Enemy MIDI channel (FL Studio numbering)'})
+    bf_channel: int = field(default=2, metadata={'title': 'BF MIDI channel (FL Studio numbering)'})
+    gf_channel: int = field(default=0, metadata={'title': 'GF MIDI channel (FL Studio numbering)\n0 for no GF notes'})
+    pattern: str = field(default="default", metadata={'title': 'Arrow patterns: default, stream, jacky\nor the path of a .json table'})
+    optimize: bool = field(default=False, metadata={'title': 'Optimize arrows (fewer jacks and\nunhittable chords, a bit slower)'})
+    difficulties: bool = field(default=False, metadata={'title': 'Also export easy and hard\n(<song>-easy.json, <song>-hard.json)'})
 
 
 def cc(c:FCGInputs)->Optional[str]:
@@ -29,13 +38,19 @@ def cc(c:FCGInputs)->Optional[str]:
         return "Jack mode must be from 0-3 inclusive"
     elif not (0 <= c.percentage_required <= 100):
         return "Percentage required must be from 0-100 inclusive"
+    elif not (1 <= c.en_channel <= 16 and 1 <= c.bf_channel <= 16 and 0 <= c.gf_channel <= 16):
+        return "MIDI channels must be from 1-16 inclusive"
+    elif c.pattern not in STYLES and not (c.pattern.endswith('.json') and os.path.exists(c.pattern)):
+        return f"Arrow patterns must be one of {', '.join(STYLES)} or an existing .json file"
     else:
         return None
 
 if __name__ == "__main__":
+    # worker processes of a frozen build must not open the UI again
+    multiprocessing.freeze_support()
     fcg_inputs = FCGInputs.get_instance_from_ui(title="Funkin' chart generator", desc="Funkin' chart generator. Generate a chart from MIDIs. MIDI ch1=EN, ch2=BF, one-indexed (based on FL)", custom_check=cc, sbmt=f"Submit and export JSON as {os.path.basename(os.getcwd())}/<song_name>.json")
     
     process(path_to=str(fcg_inputs.path_to),
             jack_mode=fcg_inputs.jack_mode,
-            percentage_required=fcg_inputs.percentage_required,p1=fcg_inputs.p1,p2=fcg_inputs.p2,gf=fcg_inputs.gf,song=fcg_inputs.song,stage=fcg_inputs.stage,needs_voices=fcg_inputs.needs_voices,scroll_speed=fcg_inputs.scroll_speed,swap_bf_en2=fcg_inputs.swap_bf_en_2)
+            percentage_required=fcg_inputs.percentage_required,p1=fcg_inputs.p1,p2=fcg_inputs.p2,gf=fcg_inputs.gf,song=fcg_inputs.song,stage=fcg_inputs.stage,needs_voices=fcg_inputs.needs_voices,scroll_speed=fcg_inputs.scroll_speed,swap_bf_en2=fcg_inputs.swap_bf_en_2,seed=None if fcg_inputs.seed < 0 else fcg_inputs.seed,en_channel=fcg_inputs.en_channel-1,bf_channel=fcg_inputs.bf_channel-1,gf_channel=fcg_inputs.gf_channel-1 if fcg_inputs.gf_channel else None,pattern=fcg_inputs.pattern,optimize=fcg_inputs.optimize,difficulties=fcg_inputs.difficulties)
     
\ No newline at end of file
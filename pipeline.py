@@ -0,0 +1,148 @@
+"""
+Chart generation split into stages whose outputs are memoized.
+
+Every stage remembers the inputs it last ran with. Running again with
+new settings only recomputes the stages those settings feed into:
+
+    parse       the MIDI bytes, channels and tracks (and the on-disk cache, if given)
+    arrows      jack_mode, seed, pattern and optimize, per side
+    sections    the arrows of that side
+    assemble    swap_bf_en2 and percentage_required
+    serialize   player names, stage, voices, scroll speed and song name
+
+    pipeline = ChartPipeline()
+    chart = pipeline.run("song.mid", settings)
+    chart = pipeline.run("song.mid", replace(settings, scroll_speed=3))  # only serialize reruns
+
+Given an Instrumentation, every stage is recorded, including the ones
+served from the memo.
+"""
+import io
+import os
+from typing import Callable, Optional, TypeVar
+
+from chart_gen import (ChartSettings, assemble_sections, chart_channel, chart_json,
+                       split_into_sections)
+from do_not_delete_or_move_this import midi2 as mid2
+from do_not_delete_or_move_this.cache import MidiCache, load_paired
+from do_not_delete_or_move_this.chart_writer import DEFAULT_MS_DIGITS, dump_chart, replace_chart
+from do_not_delete_or_move_this.instrument import Instrumentation
+
+_T = TypeVar('_T')
+
+
+class ChartPipeline:
+    """Runs the chart stages, reusing any stage whose inputs didn't change.
+    Only the last result of each stage is kept.
+    """
+
+    def __init__(self, cache: Optional[MidiCache] = None, instrumentation: Optional[Instrumentation] = None):
+        self.cache = cache
+        self.instrumentation = instrumentation
+        self._memo: dict[str, tuple[tuple, object]] = {}
+        self.ran: list[str] = []  # the stages that were recomputed on the last run
+
+    def stage(self, name: str, key: tuple, compute: Callable[[], _T],
+              count: Optional[Callable[[_T], int]] = None) -> _T:
+        """Return the memoized output of a stage if key matches the inputs
+        it last ran with, otherwise compute it. count gives the number of
+        notes in the output, for instrumentation.
+        """
+        if self.instrumentation is None:
+            return self._run_stage(name, key, compute)
+        with self.instrumentation.stage(name) as record:
+            ran = len(self.ran)
+            value = self._run_stage(name, key, compute)
+            record["cached"] = len(self.ran) == ran
+            if count is not None:
+                record["notes"] = count(value)
+        return value
+
+    def _run_stage(self, name: str, key: tuple, compute: Callable[[], _T]) -> _T:
+        memo = self._memo.get(name)
+        if memo is not None and memo[0] == key:
+            return memo[1]
+        value = compute()
+        self._memo[name] = (key, value)
+        self.ran.append(name)
+        return value
+
+    def clear(self) -> None:
+        self._memo.clear()
+
+    def run(self, midi: mid2.MidiSource, settings: ChartSettings) -> dict:
+        """Return the chart for a MIDI file, like chart_gen.generate_chart.
+        """
+        self.ran = []
+        midi_bytes = mid2.read_midi_bytes(midi)
+        channels = settings.channels()
+        parse_key = (MidiCache.key(midi_bytes, channels, settings.tracks),)
+        midi_data, full_mid_data = self.stage('parse', parse_key,
+                                              lambda: load_paired(midi_bytes, self.cache, channels, settings.tracks),
+                                              lambda paired: sum(len(notes) for notes in paired[1]))
+
+        assemble_key = parse_key
+        side_notes = {}
+        side_sections = {}
+        for side, channel in settings.side_channels():
+            arrows_key = parse_key + (channel, settings.jack_mode, settings.seed, settings.pattern, settings.optimize)
+            notes = self.stage(f'arrows.{side}', arrows_key,
+                               lambda: chart_channel(full_mid_data, channel, midi_data, settings), len)
+            side_notes[side] = notes
+            side_sections[side] = self.stage(f'sections.{side}', arrows_key,
+                                             lambda: split_into_sections(notes, midi_data), len)
+            assemble_key += (side,) + arrows_key[1:]
+
+        assemble_key += (settings.swap_bf_en2, settings.percentage_required)
+        json_notes = self.stage('assemble', assemble_key,
+                                lambda: assemble_sections(side_notes, side_sections, midi_data, settings),
+                                lambda sections: sum(len(section["sectionNotes"]) for section in sections))
+
+        serialize_key = assemble_key + (settings.p1, settings.p2, settings.gf, settings.song, settings.stage,
+                                        settings.needs_voices, settings.scroll_speed)
+        return self.stage('serialize', serialize_key, lambda: chart_json(json_notes, midi_data, settings))
+
+
+def write_instrumented(midi: mid2.MidiSource, settings: ChartSettings, json_name: str,
+                       cache: Optional[MidiCache] = None, ms_digits: Optional[int] = DEFAULT_MS_DIGITS,
+                       compress: bool = False, trace_memory: bool = True, profile: bool = True) -> dict:
+    """Chart a MIDI file to json_name while recording every stage.
+    Next to the chart, <name>.report.json gets the stage timings and note
+    counts, and <name>.pstats the cProfile stats if profile is set.
+    Return the report.
+
+    tracemalloc and cProfile slow every stage down by a lot, so the
+    stages are timed in a pass without either. If trace_memory is set,
+    a second pass adds the allocation peak of every stage to the report,
+    and if profile is set, a third pass is profiled. Both read the MIDI
+    file without the cache, so they see the whole parse.
+    """
+    midi = midi.read() if hasattr(midi, 'read') else midi
+    timing = Instrumentation(trace_memory=False)
+    with timing:
+        chart = ChartPipeline(cache, timing).run(midi, settings)
+        with timing.stage('write'), replace_chart(json_name, compress) as json_export:
+            dump_chart(chart, json_export, ms_digits)
+    if trace_memory:
+        memory = _instrumented_run(midi, settings, Instrumentation(), ms_digits)
+        for record, traced in zip(timing.stages, memory.stages):
+            record["peak_bytes"] = traced["peak_bytes"]
+    base_name = json_name[:-len('.gz')] if json_name.endswith('.gz') else json_name
+    base_name = os.path.splitext(base_name)[0]
+    timing.write_report(base_name + '.report.json')
+    if profile:
+        _instrumented_run(midi, settings, Instrumentation(profile=True, trace_memory=False),
+                          ms_digits).write_profile(base_name + '.pstats')
+    return timing.report()
+
+
+def _instrumented_run(midi: mid2.MidiSource, settings: ChartSettings, instrumentation: Instrumentation,
+                      ms_digits: Optional[int]) -> Instrumentation:
+    """Chart a MIDI file again under instrumentation, throwing the chart
+    away.
+    """
+    with instrumentation:
+        chart = ChartPipeline(None, instrumentation).run(midi, settings)
+        with instrumentation.stage('write'):
+            dump_chart(chart, io.StringIO(), ms_digits)
+    return instrumentation
@@ -0,0 +1,338 @@
+"""
+A local chart server, for tools that chart many songs one at a time.
+
+    python server.py --port 8765
+    python server.py --unix /tmp/fcg.sock --workers 4
+
+    curl --data-binary @song.mid -H 'X-Settings: {"song": "bopeebo", "jackMode": 3}' \\
+         http://127.0.0.1:8765/chart > bopeebo.json
+
+Starting Python and importing the generator takes longer than charting
+a typical song. The server is started once and keeps a pool of worker
+processes that have already imported everything, so every request only
+pays for the chart itself. Each worker keeps a ChartPipeline, so a song
+sent again with other settings skips the stages those settings don't
+feed into.
+
+It speaks plain HTTP/1.1 over localhost or a Unix socket:
+
+    POST /chart     the MIDI file as the body, settings.json keys as JSON in
+                    an X-Settings header (plus "msDigits"). Returns the chart
+    GET /metrics    queue depth, request counts and latency percentiles
+    GET /health     200 while the server accepts charts
+
+At most as many charts as there are workers run at once; the rest wait
+in a queue of at most --max-queue requests, and requests past that get
+a 503. On SIGINT or SIGTERM the server stops accepting connections,
+finishes the charts it already accepted (for up to --grace seconds),
+then stops the workers.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from typing import Optional
+
+from chart_gen import ChartSettings
+from do_not_delete_or_move_this.chart_writer import DEFAULT_MS_DIGITS, dump_chart
+from pipeline import ChartPipeline
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_MAX_BODY = 64 * 1024 * 1024
+DEFAULT_GRACE = 30.0
+# requests the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+# set in every worker by _init_worker
+_pipeline: Optional[ChartPipeline] = None
+
+
+def _init_worker() -> None:
+    global _pipeline
+    _pipeline = ChartPipeline()
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+def chart_job(midi_bytes: bytes, sjd: dict) -> tuple[str, float]:
+    """Chart a MIDI file in a worker. Return the chart JSON and how long
+    it took.
+    """
+    start = time.perf_counter()
+    settings = ChartSettings.from_json(sjd)
+    chart = _pipeline.run(midi_bytes, settings)
+    json_export = io.StringIO()
+    dump_chart(chart, json_export, sjd.get("msDigits", DEFAULT_MS_DIGITS))
+    return json_export.getvalue(), time.perf_counter() - start
+
+
+class HttpError(Exception):
+    """Answers a request with status and {"error": message}.
+    """
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Metrics:
+    """Counters and the latencies of the last LATENCY_WINDOW charts.
+    """
+
+    def __init__(self):
+        self.queued = 0  # requests waiting for a worker
+        self.running = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_seconds: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.chart_seconds: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.total_seconds: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def report(self) -> dict:
+        return {"queued": self.queued, "running": self.running, "peak_queued": self.peak_queued,
+                "completed": self.completed, "failed": self.failed, "rejected": self.rejected,
+                "queue_ms": percentiles(self.queue_seconds), "chart_ms": percentiles(self.chart_seconds),
+                "total_ms": percentiles(self.total_seconds)}
+
+
+def percentiles(seconds: deque) -> dict:
+    if not seconds:
+        return {}
+    ordered = sorted(seconds)
+    last = len(ordered) - 1
+    return {name: round(ordered[round(q * last)] * 1000, 3)
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1))}
+
+
+class ChartServer:
+    """Serves charts from a pool of warm worker processes.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = DEFAULT_MAX_QUEUE,
+                 max_body: int = DEFAULT_MAX_BODY, grace: float = DEFAULT_GRACE):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_body = max_body
+        self.grace = grace
+        self.metrics = Metrics()
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.servers: list[asyncio.AbstractServer] = []
+        self.connections: set[asyncio.StreamWriter] = set()
+        self.closing = False
+        self.idle: Optional[asyncio.Event] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                    unix_path: Optional[str] = None) -> None:
+        """Start the workers, wait until every one of them is up, then
+        listen on unix_path if given, otherwise on host and port.
+        """
+        loop = asyncio.get_running_loop()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker)
+        # one job per worker, so every process is started before the first request
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _ready) for _ in range(self.workers)))
+        self.slots = asyncio.Semaphore(self.workers)
+        self.idle = asyncio.Event()
+        self.idle.set()
+        if unix_path is not None:
+            self.servers.append(await asyncio.start_unix_server(self.handle, unix_path))
+        else:
+            self.servers.append(await asyncio.start_server(self.handle, host, port))
+
+    async def shutdown(self) -> None:
+        """Stop accepting, let the accepted charts finish, then stop the
+        workers.
+        """
+        self.closing = True
+        for server in self.servers:
+            server.close()
+        try:
+            await asyncio.wait_for(self.idle.wait(), self.grace)
+        except asyncio.TimeoutError:
+            pass
+        # whatever is left are idle keep-alive connections, or charts past the grace period
+        for writer in list(self.connections):
+            writer.close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def chart(self, midi_bytes: bytes, sjd: dict) -> str:
+        """Chart a MIDI file in the pool, waiting for a free worker.
+        """
+        metrics = self.metrics
+        if metrics.queued >= self.max_queue:
+            metrics.rejected += 1
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "too many requests queued")
+        start = time.perf_counter()
+        metrics.queued += 1
+        metrics.peak_queued = max(metrics.peak_queued, metrics.queued)
+        self.idle.clear()
+        try:
+            try:
+                await self.slots.acquire()
+            finally:
+                metrics.queued -= 1
+            metrics.running += 1
+            metrics.queue_seconds.append(time.perf_counter() - start)
+            try:
+                chart, seconds = await asyncio.get_running_loop().run_in_executor(
+                    self.pool, chart_job, midi_bytes, sjd)
+            except Exception as e:
+                metrics.failed += 1
+                raise HttpError(HTTPStatus.UNPROCESSABLE_ENTITY, f"{type(e).__name__}: {e}")
+            finally:
+                metrics.running -= 1
+                self.slots.release()
+        finally:
+            if metrics.queued + metrics.running == 0:
+                self.idle.set()
+        metrics.completed += 1
+        metrics.chart_seconds.append(seconds)
+        metrics.total_seconds.append(time.perf_counter() - start)
+        return chart
+
+    async def route(self, method: str, target: str, headers: dict[str, str], body: bytes) -> tuple[str, str]:
+        """Answer a request. Return the content type and the body.
+        """
+        path = target.split('?', 1)[0]
+        if path == '/chart' and method == 'POST':
+            if self.closing:
+                raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "shutting down")
+            try:
+                sjd = json.loads(headers.get('x-settings', '{}'))
+            except ValueError as e:
+                raise HttpError(HTTPStatus.BAD_REQUEST, f"X-Settings is not JSON: {e}")
+            if not isinstance(sjd, dict):
+                raise HttpError(HTTPStatus.BAD_REQUEST, "X-Settings must be a JSON object")
+            return 'application/json', await self.chart(body, sjd)
+        if path == '/metrics' and method == 'GET':
+            return 'application/json', json.dumps(self.metrics.report())
+        if path == '/health' and method == 'GET':
+            if self.closing:
+                raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "shutting down")
+            return 'application/json', '{"ok":true}'
+        if path in ('/chart', '/metrics', '/health'):
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not allowed on {path}")
+        raise HttpError(HTTPStatus.NOT_FOUND, f"no such path {path}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve the requests of one connection, kept alive between them
+        unless the client or shutdown says otherwise.
+        """
+        self.connections.add(writer)
+        try:
+            keep_alive = True
+            while keep_alive and not self.closing:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                try:
+                    method, target, version, headers = parse_head(head)
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await respond(writer, HTTPStatus.BAD_REQUEST, error_json("malformed request"), False)
+                    break
+                if length > self.max_body:
+                    await respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                  error_json(f"bodies are limited to {self.max_body} bytes"), False)
+                    break
+                try:
+                    body = await reader.readexactly(length)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                try:
+                    content_type, payload = await self.route(method, target, headers, body)
+                    status = HTTPStatus.OK
+                except HttpError as e:
+                    status, content_type, payload = e.status, 'application/json', error_json(str(e))
+                await respond(writer, status, payload, keep_alive and not self.closing, content_type)
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+
+def parse_head(head: bytes) -> tuple[str, str, str, dict[str, str]]:
+    """Split a request line and headers. Header names are lowercased.
+    """
+    request_line, *lines = head.decode('latin-1').rstrip('\r\n').split('\r\n')
+    method, target, version = request_line.split(' ')
+    headers = {}
+    for line in lines:
+        name, value = line.split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+
+def error_json(message: str) -> str:
+    return json.dumps({"error": message})
+
+
+async def respond(writer: asyncio.StreamWriter, status: HTTPStatus, payload: str, keep_alive: bool,
+                  content_type: str = 'application/json') -> None:
+    body = payload.encode()
+    writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                 f'Content-Type: {content_type}\r\n'
+                 f'Content-Length: {len(body)}\r\n'
+                 f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + body)
+    await writer.drain()
+
+
+async def serve(server: ChartServer, host: str, port: int, unix_path: Optional[str] = None) -> None:
+    """Run server until SIGINT or SIGTERM, then shut it down.
+    """
+    await server.start(host, port, unix_path)
+    print(f"Serving charts on {unix_path or f'http://{host}:{port}'} with {server.workers} workers")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, AttributeError, ValueError):
+            pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+    try:
+        await stop.wait()
+    finally:
+        print("Shutting down")
+        await server.shutdown()
+        if unix_path is not None and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve charts over HTTP from a pool of warm workers.")
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--unix', default=None, help='listen on this Unix socket instead')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: one per core)')
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help=f'requests waiting for a worker before new ones get a 503 (default: {DEFAULT_MAX_QUEUE})')
+    parser.add_argument('--grace', type=float, default=DEFAULT_GRACE,
+                        help=f'seconds to finish accepted charts on shutdown (default: {DEFAULT_GRACE})')
+    args = parser.parse_args(argv)
+
+    server = ChartServer(args.workers, args.max_queue, grace=args.grace)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
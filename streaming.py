@@ -0,0 +1,129 @@
+"""
+Chart generation that streams from the MIDI file to the writer.
+
+generate_chart has every note of the song in memory before the first
+section is written. stream_chart reads the notes in time order straight
+from the memory-mapped file, pairs them, picks their arrows and yields
+every section as soon as no note that belongs in it can still come.
+Only the notes of sections that are still open are kept, so memory
+grows with the longest held note instead of the length of the song.
+A note held for more than MAX_HOLD_SECONDS is dropped like a note that
+never ends, so one stuck note can't keep every section open.
+The tempo map is read first, in a pass that skips the notes.
+
+    with open("song.json", "w") as f:
+        dump_chart(stream_chart("song.mid", settings), f)
+
+The chart is the same as the one generate_chart makes, unless a note is
+held for longer than MAX_HOLD_SECONDS. Files the raw reader in smf can't
+read are charted by generate_chart instead.
+"""
+from itertools import islice
+from operator import itemgetter
+from typing import Iterator
+
+from chart_gen import (GF_NOTE_TYPE, ChartSettings, NoteCharter, channel_rng, chart_json, generate_chart,
+                       next_must_hit, section_json)
+from do_not_delete_or_move_this import midi2 as mid2, smf
+from do_not_delete_or_move_this.midi3 import NotePairer
+from do_not_delete_or_move_this.notes import EventColumns
+from do_not_delete_or_move_this.patterns import pattern_table
+from do_not_delete_or_move_this.tempo_map import TempoMap
+
+# events paired between checks for sections that can be closed
+EVENT_CHUNK = 1024
+# notes held longer than this are dropped, see NotePairer
+MAX_HOLD_SECONDS = 60.0
+
+# the order of the sides in an open section
+EN, BF, GF = range(3)
+
+
+def stream_chart(midi: mid2.MidiSource, settings: ChartSettings) -> dict:
+    """Return the chart for a MIDI file like generate_chart(lazy=True),
+    but with the MIDI file read while the sections are written.
+    Optimized arrows need every note up front, so they aren't streamed.
+    """
+    if hasattr(midi, 'read'):
+        midi = midi.read()
+    if settings.optimize:
+        return generate_chart(midi, settings, lazy=True)
+    try:
+        raw = smf.read_smf(midi, channels=())
+    except smf.SmfError:
+        return generate_chart(midi, settings, lazy=True)
+    tempo_map = TempoMap(raw.ticks_per_beat, raw.tempos, raw.meters)
+    midi_data = mid2.MidiData(tempo_map.tempos[0], raw.ticks_per_beat, EventColumns(), tempo_map)
+    return chart_json(iter_stream_sections(midi, midi_data, settings), midi_data, settings)
+
+
+def iter_stream_sections(midi: mid2.MidiSource, midi_data: mid2.MidiData,
+                         settings: ChartSettings) -> Iterator[dict]:
+    """Yield the sections of the chart while reading the notes of the
+    file. midi_data only needs the tempo map.
+    """
+    tempo_map = midi_data.tempo_map
+    tick_to_ms = tempo_map.tick_to_ms
+    section_at_ms = tempo_map.section_at_ms
+    side_channels = dict(settings.side_channels())
+    en, bf = ('bf', 'en') if settings.swap_bf_en2 else ('en', 'bf')
+    roles = [(EN, side_channels[en]), (BF, side_channels[bf])]
+    if 'gf' in side_channels:
+        roles.append((GF, side_channels['gf']))
+    table = pattern_table(settings.pattern, settings.jack_mode / 3)
+    charters: dict[int, list[tuple[int, NoteCharter]]] = {}
+    for role, channel in roles:
+        charters.setdefault(channel, []).append(
+            (role, NoteCharter(channel_rng(settings.seed, channel), table, midi_data)))
+
+    pairer = NotePairer(MAX_HOLD_SECONDS)
+    open_sections: dict[int, tuple[list, list, list]] = {}
+    last_section = -1  # the last section with a note in it
+    next_section = 0  # the first section not yielded yet
+    must_hit = True
+    prev_bpm = round(60 / midi_data.spb, 3)
+
+    def chart_exported() -> None:
+        nonlocal last_section
+        for channel, exported in pairer.exported.items():
+            for role, charter in charters.get(channel, ()):
+                for note in exported:
+                    row = charter.chart(*note)
+                    sec = section_at_ms(row[0])
+                    if sec not in open_sections:
+                        open_sections[sec] = ([], [], [])
+                    open_sections[sec][role].append(row)
+                    last_section = max(last_section, sec)
+            exported.clear()
+
+    def close(sec: int) -> dict:
+        nonlocal must_hit, prev_bpm
+        en_rows, bf_rows, gf_rows = open_sections.pop(sec, ([], [], []))
+        must_hit = next_must_hit(len(en_rows), len(bf_rows), must_hit, settings.percentage_required)
+        # if must_hit is true the camera points to bf, whose notes go on the first 4 lanes
+        section_notes = [[ms, arrow + 4 if must_hit else arrow, sus] for ms, arrow, sus in en_rows]
+        section_notes.extend([ms, arrow if must_hit else arrow + 4, sus] for ms, arrow, sus in bf_rows)
+        section_notes.extend([ms, arrow + 4 if must_hit else arrow, sus, GF_NOTE_TYPE] for ms, arrow, sus in gf_rows)
+        section_notes.sort(key=itemgetter(0, 1))
+        json_section = section_json(sec, section_notes, must_hit, tempo_map, prev_bpm)
+        prev_bpm = json_section.get("bpm", prev_bpm)
+        return json_section
+
+    with smf.open_smf(midi) as data:
+        events = ((kind, pitch, tick_to_ms(tick) / 1000, channel, velocity)
+                  for tick, kind, pitch, channel, velocity
+                  in smf.iter_smf_notes(data, settings.channels(), settings.tracks))
+        while chunk := list(islice(events, EVENT_CHUNK)):
+            pairer.feed(chunk)
+            chart_exported()
+            # notes still to come start at or after the earliest unfinished one
+            start = min([chunk[-1][2]] + [queue[0][0] for queue in pairer.pending.values() if queue])
+            closed_before = section_at_ms(start * 1000)
+            while next_section < closed_before and next_section <= last_section:
+                yield close(next_section)
+                next_section += 1
+    pairer.finish()
+    chart_exported()
+    while next_section <= last_section:
+        yield close(next_section)
+        next_section += 1
@@ -0,0 +1,108 @@
+"""
+Generate a grid of charts for one song from a single parse.
+
+    python sweep.py song.mid --jack-mode 0 1 3 --percentage 60 75 --seed 1 2 3
+
+The MIDI file is parsed and paired once. Every combination of the given
+values is then charted in a pool of worker processes and written as
+<song>-<variant>.json, e.g. bopeebo-j1-p75-s2.json. A table with the
+jack count, peak notes per second and camera switches of every variant
+is printed at the end so the most playable one can be picked quickly.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import Optional
+
+from chart_gen import ChartSettings, chart_from_paired
+from do_not_delete_or_move_this import midi2 as mid2
+from do_not_delete_or_move_this.cache import MidiCache, load_paired
+from do_not_delete_or_move_this.chart_stats import ChartDensity
+from do_not_delete_or_move_this.chart_writer import dump_chart
+from do_not_delete_or_move_this.notes import NoteColumns
+
+# set in every worker by _init_worker so the parsed song is only sent once
+_paired: Optional[tuple[mid2.MidiData, list[NoteColumns]]] = None
+
+
+def _init_worker(midi_data: mid2.MidiData, full_mid_data: list[NoteColumns]) -> None:
+    global _paired
+    _paired = (midi_data, full_mid_data)
+
+
+def variant_name(settings: ChartSettings) -> str:
+    return f'j{settings.jack_mode}-p{settings.percentage_required}-s{settings.seed}'
+
+
+def chart_variant(settings: ChartSettings, out_dir: str) -> dict:
+    """Chart one combination of settings, write it and return its summary.
+    """
+    midi_data, full_mid_data = _paired
+    chart = chart_from_paired(midi_data, full_mid_data, settings)
+    name = variant_name(settings)
+    json_name = os.path.join(out_dir, f'{settings.song}-{name}.json')
+    with open(json_name, 'w') as json_export:
+        dump_chart(chart, json_export)
+    density = ChartDensity.from_chart(chart)
+    return {"variant": name, "file": json_name,
+            "notes": len(density.player) + len(density.opponent),
+            "jacks": density.player.jacks[-1] + density.opponent.jacks[-1],
+            "peak_nps": density.player.peak_nps(),
+            "camera_switches": density.camera_switches}
+
+
+def sweep(midi: mid2.MidiSource, base: ChartSettings, jack_modes: list[int], percentages: list[int],
+          seeds: list[int], out_dir: str = '', workers: Optional[int] = None,
+          cache: Optional[MidiCache] = None) -> list[dict]:
+    """Chart every combination of jack_modes, percentages and seeds,
+    parsing midi only once. Return the summary of every variant.
+    """
+    midi_data, full_mid_data = load_paired(midi, cache, base.channels(), base.tracks)
+    variants = [replace(base, jack_mode=j, percentage_required=p, seed=s)
+                for j, p, s in itertools.product(jack_modes, percentages, seeds)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(midi_data, full_mid_data)) as executor:
+        return list(executor.map(chart_variant, variants, itertools.repeat(out_dir)))
+
+
+def print_table(summaries: list[dict]) -> None:
+    print(f"{'variant':<20} {'notes':>7} {'jacks':>7} {'peak nps':>9} {'camera switches':>16}  file")
+    for summary in summaries:
+        print(f"{summary['variant']:<20} {summary['notes']:>7} {summary['jacks']:>7} {summary['peak_nps']:>9} "
+              f"{summary['camera_switches']:>16}  {summary['file']}")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a grid of charts for one song.")
+    parser.add_argument('midi', help='the MIDI file to chart')
+    parser.add_argument('--jack-mode', type=int, nargs='+', default=[0, 1, 2, 3])
+    parser.add_argument('--percentage', type=int, nargs='+', default=[75])
+    parser.add_argument('--seed', type=int, nargs='+', default=[0])
+    parser.add_argument('--settings', default='settings.json',
+                        help='settings for everything else (default: settings.json, if it exists)')
+    parser.add_argument('--out', default='', help='directory to write the charts to')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+
+    sjd = {}
+    if os.path.exists(args.settings):
+        with open(args.settings) as sj:
+            sjd = json.load(sj)
+    if "song" not in sjd:
+        sjd["song"] = os.path.splitext(os.path.basename(args.midi))[0]
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    summaries = sweep(args.midi, ChartSettings.from_json(sjd), args.jack_mode, args.percentage, args.seed,
+                      args.out, args.workers, MidiCache())
+    print_table(summaries)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
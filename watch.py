@@ -0,0 +1,156 @@
+"""
+Rewrite a chart every time its MIDI file is saved.
+
+    python watch.py song.mid --settings settings.json --out charts/
+
+Leave it running next to the DAW: export the MIDI again and the chart is
+rewritten a moment later. The process stays alive between saves, so
+nothing is imported twice, and a ChartPipeline keeps the stages of the
+last run. Editing the settings file (or the song.settings.json sidecar
+batch.py reads) only reruns the stages those settings feed into, and a
+MIDI file saved without changes reruns nothing but the write.
+
+The files are polled for their modification time and size. A save is
+charted once they have stopped changing for --debounce seconds, so a
+DAW writing the file in several bursts is only charted once. The chart
+is written to a temporary file that then replaces it, so the game never
+loads half a chart, and a failed run leaves the last chart in place.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Optional
+
+from batch import SIDECAR_SUFFIX, song_settings
+from do_not_delete_or_move_this.chart_writer import DEFAULT_MS_DIGITS, dump_chart, replace_chart
+from pipeline import ChartPipeline
+
+# seconds between two looks at the files
+DEFAULT_INTERVAL = 0.02
+# seconds the files must stay the same before they are charted
+DEFAULT_DEBOUNCE = 0.03
+
+
+class ChartWatcher:
+    """Charts a MIDI file, then charts it again whenever it or its
+    settings change.
+    """
+
+    def __init__(self, midi_path: str, settings_path: str = 'settings.json', out_dir: str = '',
+                 ms_digits: Optional[int] = DEFAULT_MS_DIGITS, compress: bool = False,
+                 interval: float = DEFAULT_INTERVAL, debounce: float = DEFAULT_DEBOUNCE):
+        self.midi_path = midi_path
+        self.settings_path = settings_path
+        self.out_dir = out_dir
+        self.ms_digits = ms_digits
+        self.compress = compress
+        self.interval = interval
+        self.debounce = debounce
+        self.pipeline = ChartPipeline()
+        self.paths = (midi_path, settings_path, os.path.splitext(midi_path)[0] + SIDECAR_SUFFIX)
+
+    def signature(self) -> tuple:
+        """The modification time and size of every watched file, None for
+        the ones that don't exist.
+        """
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def settle(self, signature: tuple) -> tuple:
+        """Wait until the files have stayed the same for debounce seconds.
+        Return their signature by then.
+        """
+        deadline = time.monotonic() + self.debounce
+        while (remaining := deadline - time.monotonic()) > 0:
+            time.sleep(min(self.interval, remaining))
+            current = self.signature()
+            if current != signature:
+                signature = current
+                deadline = time.monotonic() + self.debounce
+        return signature
+
+    def chart(self) -> str:
+        """Chart the MIDI file now. Return where the chart was written.
+        """
+        base = {}
+        if os.path.exists(self.settings_path):
+            with open(self.settings_path) as sj:
+                base = json.load(sj)
+        settings = song_settings(self.midi_path, base)
+        json_name = os.path.join(self.out_dir, settings.song + ('.json.gz' if self.compress else '.json'))
+        chart = self.pipeline.run(self.midi_path, settings)
+        with replace_chart(json_name, self.compress) as json_export:
+            dump_chart(chart, json_export, self.ms_digits)
+        return json_name
+
+    def run(self) -> None:
+        """Chart the MIDI file, then keep charting it on every change until
+        interrupted.
+        """
+        charted = None
+        while True:
+            signature = self.signature()
+            if signature != charted:
+                signature = self.settle(signature)
+                charted = signature
+                if signature[0] is None:
+                    print(f"Waiting for {self.midi_path}")
+                else:
+                    self.rebuild(signature)
+            time.sleep(self.interval)
+
+    def rebuild(self, signature: tuple) -> None:
+        """Chart the MIDI file and print how long it took since the save.
+        """
+        start = time.perf_counter()
+        try:
+            json_name = self.chart()
+        except Exception:
+            print(f"Failed, keeping the last chart:\n{traceback.format_exc()}")
+            return
+        # the time since the newest watched file was saved, including the debounce
+        saved_ns = max(entry[0] for entry in signature if entry is not None)
+        print(f"Saved to {json_name} in {(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"{(time.time_ns() - saved_ns) / 1e6:.0f} ms after the save "
+              f"(reran: {', '.join(self.pipeline.ran) or 'nothing'})")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Rewrite a chart whenever its MIDI file changes.")
+    parser.add_argument('midi', help='the MIDI file to watch')
+    parser.add_argument('--settings', default='settings.json',
+                        help='settings for the song, also watched (default: settings.json)')
+    parser.add_argument('--out', default='', help='directory to write the chart to')
+    parser.add_argument('--ms-digits', type=int, default=DEFAULT_MS_DIGITS,
+                        help=f'decimal places kept on note times and sustains (default: {DEFAULT_MS_DIGITS})')
+    parser.add_argument('--gzip', action='store_true', help='write a gzipped <song>.json.gz')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f'seconds between checks for changes (default: {DEFAULT_INTERVAL})')
+    parser.add_argument('--debounce', type=float, default=DEFAULT_DEBOUNCE,
+                        help=f'seconds the files must stop changing before charting (default: {DEFAULT_DEBOUNCE})')
+    args = parser.parse_args(argv)
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    watcher = ChartWatcher(args.midi, args.settings, args.out, args.ms_digits, args.gzip,
+                           args.interval, args.debounce)
+    print(f"Watching {args.midi}, press Ctrl+C to stop")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())